@@ -1 +1,9 @@
 # Empty file for great migration new file structure
+
+DATA_CONFIG = "heatmiserneo_config"
+
+
+async def async_setup(hass, config):
+    """ Keep the full configuration, for the platforms loaded by discovery. """
+    hass.data[DATA_CONFIG] = config
+    return True
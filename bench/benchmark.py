@@ -0,0 +1,258 @@
+"""
+Scaling benchmark of the Neo-hub poll path against the local simulator.
+
+For each zone count a simulated hub is started and polled for a number of
+cycles through NeoHubCoordinator, the way Home Assistant polls it. Every
+cycle reports hub round trips, bytes on the wire, wall-clock time and the
+longest time the event loop was blocked. The coordinator mode polls a hub
+with GET_LIVE_DATA, the info mode a hub of older firmware that only
+answers INFO. The legacy mode replays the old per-entity polling for
+comparison: INFO and ENGINEERS_DATA for every thermostat, each through the
+original blocking json_request on a fresh socket, run on the event loop.
+
+The simulated hub runs on its own event loop in a background thread, like
+a real hub it keeps answering while the measured loop is blocked.
+
+Needs Home Assistant importable, run from the repository root:
+
+    python bench/benchmark.py --zones 1,5,20,50,100,200 --latency 0.01
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from neohub_simulator import NeoHubSimulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENT = "heatmiserneo"
+
+
+def load_component():
+    """ Import the repository as the heatmiserneo package. """
+    spec = importlib.util.spec_from_file_location(
+        COMPONENT, os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[COMPONENT] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+class LoopMonitor:
+    """ Measures the longest stall of the event loop.
+
+    A watchdog thread keeps asking the loop to run a callback and times
+    how long the loop takes to get to it, so a loop blocked without ever
+    yielding is measured too.
+    """
+
+    INTERVAL = 0.001
+
+    def __init__(self):
+        self.max_block = 0.0
+        self._loop = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            answered = threading.Event()
+            sent = time.perf_counter()
+            self._loop.call_soon_threadsafe(answered.set)
+            answered.wait()
+            self.max_block = max(self.max_block, time.perf_counter() - sent)
+            time.sleep(self.INTERVAL)
+
+    def start(self):
+        self.max_block = 0.0
+        self._loop = asyncio.get_event_loop()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopping.set()
+        while self._thread.is_alive():
+            await asyncio.sleep(self.INTERVAL)
+
+
+class SimulatorThread:
+    """ Runs a simulator on its own event loop in a background thread. """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def _call(self, coroutine):
+        """ Run a coroutine on the simulator loop and wait for it. """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def start(self):
+        self._thread.start()
+        self._call(self.simulator.start())
+
+    async def _async_stop(self):
+        """ Stop the simulator once the connections it serves have ended. """
+        await self.simulator.stop()
+        tasks = [task for task in asyncio.all_tasks()
+                 if task is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+
+    async def stop(self):
+        # Awaited, the caller's loop still has to close its sockets.
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            self._async_stop(), self._loop))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def legacy_json_request(host, port, request):
+    """ The json_request of the old per-entity thermostats, blocking. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(5)
+
+    try:
+        sock.connect((host, port))
+    except OSError:
+        sock.close()
+        return False
+
+    sock.send(bytearray(json.dumps(request) + "\0\r", "utf-8"))
+    try:
+        buf = sock.recv(4096)
+    except socket.timeout:
+        sock.close()
+        return False
+
+    # read until a newline or timeout
+    buffering = True
+    while buffering:
+        if "\n" in str(buf, "utf-8"):
+            response = str(buf, "utf-8").split("\n")[0]
+            buffering = False
+        else:
+            try:
+                more = sock.recv(4096)
+            except socket.timeout:
+                more = None
+            if not more:
+                buffering = False
+                response = str(buf, "utf-8")
+            else:
+                buf += more
+
+    sock.close()
+
+    response = response.rstrip('\0')
+    return json.loads(response, strict=False)
+
+
+async def legacy_cycle(simulator):
+    """ Poll like every entity did before the shared coordinator.
+
+    Nothing is awaited, the event loop is blocked for the whole cycle as
+    it was by the old json_request.
+    """
+    for name in simulator.devices:
+        response = legacy_json_request("127.0.0.1", simulator.port, {"INFO": 0})
+        legacy_json_request("127.0.0.1", simulator.port, {"ENGINEERS_DATA": 0})
+        if response:
+            for device in response["devices"]:
+                if device["device"] == name:
+                    break
+
+
+async def run_mode(mode, zones, args):
+    """ Return the per cycle averages of one mode at one zone count. """
+    neohub = sys.modules[COMPONENT + ".neohub"]
+    coordinator_module = sys.modules[COMPONENT + ".coordinator"]
+    # Hubs of the old firmware closed the socket after every response,
+    # the old json_request read until then.
+    simulator = NeoHubSimulator(
+        zones, latency=args.latency, padding=args.padding, churn=args.churn,
+        seed=zones, live_data=mode == "coordinator",
+        close_after_response=mode == "legacy")
+    hub = SimulatorThread(simulator)
+    hub.start()
+    coordinator = coordinator_module.NeoHubCoordinator(
+        neohub.NeoHubClient("127.0.0.1", simulator.port))
+    if mode != "legacy":
+        await coordinator.async_bootstrap()
+        await coordinator.async_update()
+
+    monitor = LoopMonitor()
+    simulator.stats.reset()
+    monitor.start()
+    started = time.perf_counter()
+    for _ in range(args.cycles):
+        if mode != "legacy":
+            # A real poll comes after the live values have expired.
+            coordinator.client.cache.invalidate("INFO", "GET_LIVE_DATA")
+            await coordinator.async_update()
+        else:
+            await legacy_cycle(simulator)
+        # Let the loop breathe between cycles, the longest block is per cycle.
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+
+    coordinator.client.close()
+    await hub.stop()
+    stats = simulator.stats
+    return {
+        "round_trips": stats.round_trips / args.cycles,
+        "connections": stats.connections / args.cycles,
+        "kb_in": stats.bytes_out / 1024 / args.cycles,
+        "kb_out": stats.bytes_in / 1024 / args.cycles,
+        "ms": elapsed * 1000 / args.cycles,
+        "block_ms": monitor.max_block * 1000,
+    }
+
+
+async def run(args):
+    modes = ["coordinator", "info"] + (["legacy"] if args.legacy else [])
+    print("%6s %-12s %12s %8s %10s %10s %10s %10s" % (
+        "zones", "mode", "round trips", "sockets", "KB in", "KB out",
+        "ms/cycle", "block ms"))
+    for zones in args.zones:
+        for mode in modes:
+            result = await run_mode(mode, zones, args)
+            print("%6d %-12s %12.1f %8.1f %10.1f %10.2f %10.1f %10.2f" % (
+                zones, mode, result["round_trips"], result["connections"],
+                result["kb_in"], result["kb_out"], result["ms"],
+                result["block_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--zones", default="1,5,20,50,100,200",
+                        type=lambda value: [int(zones) for zones in value.split(",")])
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the simulated hub takes per request")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="extra bytes per device in INFO")
+    parser.add_argument("--churn", type=float, default=0.1,
+                        help="share of zones changing per INFO")
+    parser.add_argument("--no-legacy", dest="legacy", action="store_false",
+                        help="skip the per-entity polling baseline")
+    args = parser.parse_args()
+
+    load_component()
+    importlib.import_module(COMPONENT + ".neohub")
+    importlib.import_module(COMPONENT + ".coordinator")
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
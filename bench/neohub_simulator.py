@@ -0,0 +1,336 @@
+"""
+Local stand-in for a Heatmiser Neo-hub.
+
+Speaks the legacy JSON protocol used by the component (null terminated
+frames on one TCP socket) for INFO, ENGINEERS_DATA, HOLD, FROST_ON,
+FROST_OFF, SET_FROST, SET_TEMP, TIMER_ON, TIMER_OFF, GET_TEMPLOG,
+GET_HOURSRUN, READ_COMFORT_LEVELS and SET_COMFORT_LEVELS, and like newer
+firmware for GET_LIVE_DATA, GET_ENGINEERS and GET_SYSTEM, with a configurable number of zones,
+per request latency, payload padding and fault injection.
+
+Run it on its own to point a Home Assistant test instance at it:
+
+    python bench/neohub_simulator.py --zones 20 --port 4242
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import random
+
+_LOGGER = logging.getLogger(__name__)
+
+TERMINATOR = b"\0"
+
+
+class SimulatorStats:
+    """ Traffic seen by the simulator. """
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def round_trips(self):
+        """ Return the number of requests answered or dropped. """
+        return sum(self.requests.values())
+
+    def reset(self):
+        """ Start counting from zero. """
+        self.__init__()
+
+
+class NeoHubSimulator:
+    """ Asyncio TCP server answering like a Neo-hub. """
+
+    def __init__(self, zones=10, plugs=0, latency=0.0, padding=0, churn=0.0,
+                 drop_rate=0.0, stall_rate=0.0, close_after_response=False,
+                 seed=None, live_data=True):
+        self.latency = latency
+        self.padding = padding
+        self.churn = churn
+        self.drop_rate = drop_rate
+        self.stall_rate = stall_rate
+        self.close_after_response = close_after_response
+        self.live_data = live_data
+        self.timestamps = {
+            "TIMESTAMP_DEVICE_LISTS": 1,
+            "TIMESTAMP_ENGINEERS": 1,
+            "TIMESTAMP_PROFILE_COMFORT_LEVELS": 1,
+            "TIMESTAMP_SYSTEM": 1,
+        }
+        self.stats = SimulatorStats()
+        self._random = random.Random(seed)
+        self._server = None
+        self.devices = {}
+        self.engineers = {}
+        self.profiles = {}
+        for index in range(zones):
+            self._add_device("Zone %d" % (index + 1), 1)
+        for index in range(plugs):
+            self._add_device("Plug %d" % (index + 1), 6)
+
+    def _add_device(self, name, device_type):
+        """ Create a device with plausible values. """
+        self.devices[name] = {
+            "device": name,
+            "DEVICE_TYPE": device_type,
+            "AWAY": False,
+            "COOLING": False,
+            "COOLING_ENABLED": False,
+            "CURRENT_SET_TEMPERATURE": "20.0",
+            "CURRENT_TEMPERATURE": "%.1f" % self._random.uniform(17, 22),
+            "HEATING": False,
+            "HOLD_TEMPERATURE": 20,
+            "HOLD_TIME": "0:00",
+            "HUMIDITY": 0,
+            "STANDBY": False,
+            "STAT_MODE": {"TIMECLOCK": True} if device_type == 6 else {"THERMOSTAT": True},
+            "TEMPERATURE_FORMAT": False,
+            "TEMP_HOLD": False,
+            "TIMER": False,
+            "MANUAL_OFF": False,
+        }
+        self.profiles[name] = _hub_profile({
+            day: {"wake": ["07:00", 21], "leave": ["09:00", 16],
+                  "return": ["17:00", 21], "sleep": ["22:30", 16]}
+            for day in ("mon-fri", "sat-sun")
+        })
+        self.engineers[name] = {
+            "FROST TEMPERATURE": 12,
+            "OUTPUT DELAY": 0,
+            "SWITCHING DIFFERENTIAL": 1,
+        }
+
+    @property
+    def port(self):
+        """ Return the port the simulator listens on. """
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host="127.0.0.1", port=0):
+        """ Start listening, port 0 picks a free port. """
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, limit=2 ** 20)
+
+    async def stop(self):
+        """ Stop listening. """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        """ Answer requests on one socket until the client goes away. """
+        self.stats.connections += 1
+        try:
+            while True:
+                try:
+                    frame = await reader.readuntil(TERMINATOR)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                self.stats.bytes_in += len(frame)
+                request = frame[:-len(TERMINATOR)].strip()
+                if not request:
+                    # The "\r" sent after every terminator.
+                    continue
+                request = json.loads(request)
+                command = next(iter(request))
+                self.stats.requests[command] = self.stats.requests.get(command, 0) + 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                fault = self._random.random()
+                if fault < self.drop_rate:
+                    return
+                if fault < self.drop_rate + self.stall_rate:
+                    await asyncio.sleep(3600)
+                    return
+                response = json.dumps(self.handle(request)).encode() + TERMINATOR
+                self.stats.bytes_out += len(response)
+                writer.write(response)
+                await writer.drain()
+                if self.close_after_response:
+                    return
+        finally:
+            writer.close()
+
+    def handle(self, request):
+        """ Return the response to a decoded request. """
+        command, value = next(iter(request.items()))
+        if command == "INFO":
+            self._churn()
+            devices = list(self.devices.values())
+            if self.padding:
+                devices = [dict(device, PADDING="x" * self.padding) for device in devices]
+            return {"devices": devices}
+        if command == "ENGINEERS_DATA":
+            return self.engineers
+        if command in ("GET_TEMPLOG", "GET_HOURSRUN"):
+            return {
+                device["device"]: self._log(command, device)
+                for device in self._targets(value)
+            }
+        if command == "READ_COMFORT_LEVELS":
+            return {
+                device["device"]: self.profiles[device["device"]]
+                for device in self._targets(value)
+            }
+        if command == "SET_COMFORT_LEVELS":
+            profile, names = value
+            for device in self._targets(names):
+                self.profiles[device["device"]] = _hub_profile(profile)
+            self.timestamps["TIMESTAMP_PROFILE_COMFORT_LEVELS"] += 1
+            return {"result": "profile was set"}
+        if self.live_data and command == "GET_LIVE_DATA":
+            self._churn()
+            return dict(self.timestamps, devices=[
+                self._live_device(device) for device in self.devices.values()])
+        if self.live_data and command == "GET_ENGINEERS":
+            return {
+                name: {
+                    "DEVICE_TYPE": self.devices[name]["DEVICE_TYPE"],
+                    "FROST_TEMP": engineers["FROST TEMPERATURE"],
+                    "OUTPUT_DELAY": engineers["OUTPUT DELAY"],
+                    "SWITCHING DIFFERENTIAL": engineers["SWITCHING DIFFERENTIAL"],
+                }
+                for name, engineers in self.engineers.items()
+            }
+        if self.live_data and command == "GET_SYSTEM":
+            return {"CORF": "C"}
+        if command == "HOLD":
+            hold, names = value
+            for device in self._targets(names):
+                device["TEMP_HOLD"] = bool(hold["hours"] or hold["minutes"])
+                device["HOLD_TEMPERATURE"] = hold["temp"]
+                device["HOLD_TIME"] = "%d:%02d" % (hold["hours"], hold["minutes"])
+                if device["TEMP_HOLD"]:
+                    device["CURRENT_SET_TEMPERATURE"] = "%.1f" % hold["temp"]
+            return {"result": "temperature on hold"}
+        if command in ("FROST_ON", "FROST_OFF"):
+            for device in self._targets(value):
+                device["STANDBY"] = command == "FROST_ON"
+            return {"result": "frost on" if command == "FROST_ON" else "frost off"}
+        if command == "SET_FROST":
+            temperature, names = value
+            for device in self._targets(names):
+                self.engineers[device["device"]]["FROST TEMPERATURE"] = temperature
+            self.timestamps["TIMESTAMP_ENGINEERS"] += 1
+            return {"result": "temperature was set"}
+        if command in ("TIMER_ON", "TIMER_OFF"):
+            for device in self._targets(value):
+                device["TIMER"] = command == "TIMER_ON"
+            return {"result": "timers on" if command == "TIMER_ON" else "timers off"}
+        if command == "SET_TEMP":
+            temperature, names = value
+            for device in self._targets(names):
+                device["CURRENT_SET_TEMPERATURE"] = "%.1f" % temperature
+            return {"result": "temperature was set"}
+        return {"error": "Invalid argument to %s" % command}
+
+    def _log(self, command, device):
+        """ Return a week of a device's log, keyed by day. """
+        today = datetime.date.today()
+        log = {}
+        for days in range(7):
+            day = (today - datetime.timedelta(days=days)).isoformat()
+            if command == "GET_HOURSRUN":
+                log[day] = self._random.randint(0, 8)
+            else:
+                log[day] = [float(device["CURRENT_TEMPERATURE"])] * 4
+        return log
+
+    def _live_device(self, device):
+        """ Return a device the way GET_LIVE_DATA lists it. """
+        live = {
+            "ZONE_NAME": device["device"],
+            "ACTUAL_TEMP": device["CURRENT_TEMPERATURE"],
+            "AWAY": device["AWAY"],
+            "COOL_MODE": device["COOLING_ENABLED"],
+            "COOL_ON": device["COOLING"],
+            "HEAT_ON": device["HEATING"],
+            "HOLD_ON": device["TEMP_HOLD"],
+            "HOLD_TEMP": device["HOLD_TEMPERATURE"],
+            "HOLD_TIME": device["HOLD_TIME"],
+            "MANUAL_OFF": device["MANUAL_OFF"],
+            "RELATIVE_HUMIDITY": device["HUMIDITY"],
+            "SET_TEMP": device["CURRENT_SET_TEMPERATURE"],
+            "STANDBY": device["STANDBY"],
+            "THERMOSTAT": "THERMOSTAT" in device["STAT_MODE"],
+            "TIMECLOCK": "TIMECLOCK" in device["STAT_MODE"],
+            "TIMER_ON": device["TIMER"],
+        }
+        if self.padding:
+            live["PADDING"] = "x" * self.padding
+        return live
+
+    def _targets(self, names):
+        """ Return the devices addressed by a name or a list of names. """
+        if isinstance(names, str):
+            names = [names]
+        return [self.devices[name] for name in names if name in self.devices]
+
+    def _churn(self):
+        """ Move the temperature of a share of the zones. """
+        for device in self.devices.values():
+            if self._random.random() < self.churn:
+                current = float(device["CURRENT_TEMPERATURE"])
+                current += self._random.choice((-0.1, 0.1))
+                device["CURRENT_TEMPERATURE"] = "%.1f" % current
+                device["HEATING"] = current < float(device["CURRENT_SET_TEMPERATURE"])
+
+
+def _hub_profile(value):
+    """ Return a written profile the way the hub stores and reads it back:
+    lower case keys, zero padded times and temperatures as floats. """
+    if isinstance(value, dict):
+        return {key.lower(): _hub_profile(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_hub_profile(item) for item in value]
+    if isinstance(value, str) and ":" in value:
+        hours, minutes = value.split(":", 1)
+        return "%02d:%s" % (int(hours), minutes)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4242)
+    parser.add_argument("--zones", type=int, default=10)
+    parser.add_argument("--plugs", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds before each response")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="extra bytes per device in INFO")
+    parser.add_argument("--churn", type=float, default=0.1,
+                        help="share of zones changing per INFO")
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--close-after-response", action="store_true")
+    parser.add_argument("--legacy", action="store_true",
+                        help="answer like older firmware, without GET_LIVE_DATA")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = NeoHubSimulator(
+        args.zones, args.plugs, args.latency, args.padding, args.churn,
+        args.drop_rate, args.stall_rate, args.close_after_response,
+        live_data=not args.legacy)
+
+    async def serve():
+        await simulator.start(args.host, args.port)
+        _LOGGER.info("Simulated Neo-hub with %d zones on %s:%d",
+                     args.zones, args.host, simulator.port)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.get_event_loop().run_until_complete(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -38,15 +38,29 @@ from homeassistant.const import (ATTR_ATTRIBUTION,
                                  CONF_HOST,
                                  CONF_NAME,
                                  CONF_PORT,
+                                 CONF_SCAN_INTERVAL,
+                                 EVENT_HOMEASSISTANT_STOP,
                                  STATE_OFF,
                                  STATE_ON,
                                  TEMP_CELSIUS,
                                  TEMP_FAHRENHEIT,
 )
+from homeassistant.exceptions import HomeAssistantError
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.discovery import async_load_platform
+from homeassistant.helpers.storage import Store
+from homeassistant.core import callback
 
-import socket
+import asyncio
 import json
+import time
+from datetime import timedelta
+
+from . import DATA_CONFIG
+from .coordinator import DATA_COORDINATORS, NeoHubCoordinator, get_client
+from .history import ZoneHistory
+from .zonelog import HOURS_RUN, TEMPERATURE_LOG
+from .neohub import TRACE_SAMPLE_RATE
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -54,17 +68,60 @@ VERSION = '2.0.2'
 
 SUPPORT_FLAGS = 0
 
+SCAN_INTERVAL = timedelta(seconds=60)
+
 ATTRIBUTION = "Data provided by Heatmiser Neo"
 
 COMPONENT_DOMAIN = "heatmiserneo"
+
+CONF_TEMPERATURE_DEADBAND = "temperature_deadband"
+CONF_TRACE_SAMPLE_RATE = "trace_sample_rate"
+CONF_HUBS = "hubs"
+
+DEFAULT_PORT = 4242
+
+STORAGE_VERSION = 1
+STORAGE_KEY = COMPONENT_DOMAIN + ".{}_{}"
+LOG_STORAGE_KEY = COMPONENT_DOMAIN + ".logs_{}_{}"
 SERVICE_HOLD_TEMP = "hold_temp"
 
 SERVICE_NEO_UPDATE = "neo_update"
+SERVICE_NEO_UPDATE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    }
+)
+
+SERVICE_DUMP_TRACE = "dump_trace"
+TRACE_FILE = COMPONENT_DOMAIN + "_trace_{}_{}.json"
+
+SERVICE_GET_TEMPERATURE_LOG = "get_temperature_log"
+SERVICE_GET_HOURS_RUN = "get_hours_run"
+SERVICE_GET_LOG_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    }
+)
+EVENT_TEMPERATURE_LOG = COMPONENT_DOMAIN + "_temperature_log"
+EVENT_HOURS_RUN = COMPONENT_DOMAIN + "_hours_run"
+
+SERVICE_READ_PROFILES = "read_profiles"
+SERVICE_READ_PROFILES_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional("refresh", default=False): cv.boolean,
+    }
+)
+EVENT_PROFILES = COMPONENT_DOMAIN + "_profiles"
+
+SERVICE_SET_PROFILE = "set_profile"
+SERVICE_SET_PROFILE_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Required("profile"): dict,
+    }
+)
 
 # New
 SERVICE_HOLD_TEMPERATURE = "hold_temperature"
 SERVICE_HOLD_TEMPERATURE_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
     vol.Required("hold_temperature"): cv.string,
     vol.Required("hold_hours"): cv.string,
     vol.Required("hold_minutes"): cv.string,
@@ -73,25 +130,25 @@ SERVICE_HOLD_TEMPERATURE_SCHEMA = vol.Schema({
 
 SERVICE_CANCEL_HOLD = "cancel_hold"
 SERVICE_CANCEL_HOLD_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
     }
 )
 
 SERVICE_ACTIVATE_FROST = "activate_frost"
 SERVICE_ACTIVATE_FROST_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
     }
 )
 
 SERVICE_CANCEL_FROST = "cancel_frost"
 SERVICE_CANCEL_FROST_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
     }
 )
 
 SERVICE_SET_FROST_TEMP = "set_frost_temperature"
 SERVICE_SET_FROST_TEMP_SCHEMA = vol.Schema({
-    vol.Required(ATTR_ENTITY_ID): cv.entity_id,
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
     vol.Required("frost_temperature"): cv.string,
     }
 )
@@ -116,16 +173,26 @@ SERVICE_HOLD_TEMP_SCHEMA = vol.Schema(
 # Heatmiser doesn't really have an off mode - standby is a preset - implement later
 hvac_modes = [HVAC_MODE_HEAT]
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+HUB_SCHEMA = vol.Schema(
     {
         vol.Required(CONF_HOST): cv.string,
-        vol.Required(CONF_PORT): cv.port,
+        vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.port,
     }
 )
 
-# Fix this when I figure out why my config won't read in. Voluptuous schma thing.
-# Excludes time clocks from being included if set to True
-ExcludeTimeClock = False
+PLATFORM_SCHEMA = vol.All(
+    PLATFORM_SCHEMA.extend(
+        {
+            vol.Optional(CONF_HOST): cv.string,
+            vol.Optional(CONF_PORT, default=DEFAULT_PORT): cv.port,
+            vol.Optional(CONF_HUBS): vol.All(cv.ensure_list, [HUB_SCHEMA]),
+            vol.Optional(CONF_TEMPERATURE_DEADBAND, default=0): vol.Coerce(float),
+            vol.Optional(CONF_TRACE_SAMPLE_RATE, default=TRACE_SAMPLE_RATE): vol.All(
+                vol.Coerce(float), vol.Range(min=0, max=1)),
+        }
+    ),
+    cv.has_at_least_one_key(CONF_HOST, CONF_HUBS),
+)
 
 def get_entity_from_domain(hass, domain, entity_id):
     component = hass.data.get(domain)
@@ -139,50 +206,28 @@ def get_entity_from_domain(hass, domain, entity_id):
     return entity
 
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
-    """ Sets up a Heatmiser Neo-Hub And Returns Neostats"""
-    host = config.get(CONF_HOST, None)
-    port = config.get(CONF_PORT, 4242)
-
-    thermostats = []
-
-    NeoHubJson = HeatmiserNeostat(TEMP_CELSIUS, False, host, port).json_request({"INFO": 0})
+def get_entities_from_domain(hass, domain, entity_ids):
+    return [get_entity_from_domain(hass, domain, entity_id) for entity_id in entity_ids]
 
-    _LOGGER.debug(NeoHubJson)
 
-    for device in NeoHubJson['devices']:
-        if device['DEVICE_TYPE'] != 6:
-            name = device['device']
-            tmptempfmt = device['TEMPERATURE_FORMAT']
-            if (tmptempfmt == False) or (tmptempfmt.upper() == "C"):
-                temperature_unit = TEMP_CELSIUS
-            else:
-                temperature_unit = TEMP_FAHRENHEIT
-            away = device['AWAY']
-            current_temperature = device['CURRENT_TEMPERATURE']
-            set_temperature = device['CURRENT_SET_TEMPERATURE']
-            on_hold = device['TEMP_HOLD']
-
-            _LOGGER.info("Thermostat Name: %s " % name)
-            _LOGGER.info("Thermostat Away Mode: %s " % away)
-            _LOGGER.info("Thermostat Current Temp: %s " % current_temperature)
-            _LOGGER.info("Thermostat Set Temp: %s " % set_temperature)
-            _LOGGER.info("Thermostat Unit Of Measurement: %s " % temperature_unit)
-            _LOGGER.info("Thermostat is on hold: %r " % on_hold)
-
-            if (('TIMECLOCK' in device['STAT_MODE']) and (ExcludeTimeClock == True)):
-              _LOGGER.debug("Found a Neostat configured in timer mode named: %s skipping" % device['device'])
-            else:
-              thermostats.append(HeatmiserNeostat(temperature_unit, away, host, port, name))
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """ Sets up Heatmiser Neo-Hubs And Returns Neostats"""
+    hubs = list(config.get(CONF_HUBS, []))
+    if CONF_HOST in config:
+        hubs.insert(0, {CONF_HOST: config[CONF_HOST], CONF_PORT: config[CONF_PORT]})
 
-        elif device['DEVICE_TYPE'] == 6:
-            _LOGGER.debug("Found a Neoplug named: %s skipping" % device['device'])
+    # Every hub has its own client, cache and coordinator and is set up and
+    # polled on its own, so a slow hub does not hold up the others.
+    await asyncio.gather(*[
+        async_setup_hub(hass, config, hub[CONF_HOST], hub[CONF_PORT], async_add_entities)
+        for hub in hubs
+    ])
 
     async def async_hold_temperature(call):
         """Call hold temperature service handler."""
         await async_handle_hold_temperature_service(hass, call)
 
-    hass.services.register(
+    hass.services.async_register(
         COMPONENT_DOMAIN, SERVICE_HOLD_TEMPERATURE, async_hold_temperature, schema=SERVICE_HOLD_TEMPERATURE_SCHEMA
     )
 
@@ -190,7 +235,7 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
         """Call cancel hold service handler."""
         await async_handle_cancel_hold_service(hass, call)
 
-    hass.services.register(
+    hass.services.async_register(
         COMPONENT_DOMAIN, SERVICE_CANCEL_HOLD, async_cancel_hold, schema=SERVICE_CANCEL_HOLD_SCHEMA
     )
 
@@ -198,7 +243,7 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
         """Call activate frost service handler."""
         await async_handle_activate_frost_service(hass, call)
 
-    hass.services.register(
+    hass.services.async_register(
         COMPONENT_DOMAIN, SERVICE_ACTIVATE_FROST, async_activate_frost, schema=SERVICE_ACTIVATE_FROST_SCHEMA
     )
 
@@ -206,7 +251,7 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
         """Call cancel frost service handler."""
         await async_handle_cancel_frost_service(hass, call)
 
-    hass.services.register(
+    hass.services.async_register(
         COMPONENT_DOMAIN, SERVICE_CANCEL_FROST, async_cancel_frost, schema=SERVICE_CANCEL_FROST_SCHEMA
     )
 
@@ -214,166 +259,357 @@ def setup_platform(hass, config, add_devices, discovery_info=None):
         """Call set frost temp service handler."""
         await async_handle_set_frost_temp_service(hass, call)
 
-    hass.services.register(
+    hass.services.async_register(
         COMPONENT_DOMAIN, SERVICE_SET_FROST_TEMP, async_set_frost_temp, schema=SERVICE_SET_FROST_TEMP_SCHEMA
     )
 
     async def async_neo_update(call):
         """Call neo update service handler."""
-        await async_handle_neo_update_service(hass, call, host, port)
-
-    hass.services.register(
-        COMPONENT_DOMAIN, SERVICE_NEO_UPDATE, async_neo_update)
-
-
+        await async_handle_neo_update_service(hass, call)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_NEO_UPDATE, async_neo_update, schema=SERVICE_NEO_UPDATE_SCHEMA)
+
+    async def async_dump_trace(call):
+        """Call dump trace service handler."""
+        await async_handle_dump_trace_service(hass, call)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_DUMP_TRACE, async_dump_trace)
+
+    async def async_get_temperature_log(call):
+        """Call get temperature log service handler."""
+        await async_handle_get_log_service(hass, call, TEMPERATURE_LOG, EVENT_TEMPERATURE_LOG)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_GET_TEMPERATURE_LOG, async_get_temperature_log, schema=SERVICE_GET_LOG_SCHEMA)
+
+    async def async_get_hours_run(call):
+        """Call get hours run service handler."""
+        await async_handle_get_log_service(hass, call, HOURS_RUN, EVENT_HOURS_RUN)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_GET_HOURS_RUN, async_get_hours_run, schema=SERVICE_GET_LOG_SCHEMA)
+
+    async def async_read_profiles(call):
+        """Call read profiles service handler."""
+        await async_handle_read_profiles_service(hass, call)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_READ_PROFILES, async_read_profiles, schema=SERVICE_READ_PROFILES_SCHEMA)
+
+    async def async_set_profile(call):
+        """Call set profile service handler."""
+        await async_handle_set_profile_service(hass, call)
+
+    hass.services.async_register(
+        COMPONENT_DOMAIN, SERVICE_SET_PROFILE, async_set_profile, schema=SERVICE_SET_PROFILE_SCHEMA)
+
+
+async def async_setup_hub(hass, config, host, port, async_add_entities):
+    """ Sets up one Neo-Hub and adds its Neostats. """
+    coordinator = NeoHubCoordinator(
+        get_client(hass, host, port, config.get(CONF_TRACE_SAMPLE_RATE)),
+        config.get(CONF_TEMPERATURE_DEADBAND),
+        config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL).total_seconds(),
+        Store(hass, STORAGE_VERSION, STORAGE_KEY.format(host, port)),
+        Store(hass, STORAGE_VERSION, LOG_STORAGE_KEY.format(host, port)))
+    hass.data.setdefault(DATA_COORDINATORS, {})[(host, port)] = coordinator
+    await coordinator.logs.async_load()
+    known_devices = set()
+
+    @callback
+    def async_add_new_devices():
+        """Add the thermostats of devices not seen before."""
+        thermostats = []
+        for device in coordinator.devices.values():
+            if device.name in known_devices:
+                continue
+            known_devices.add(device.name)
+            if device.neoplug:
+                _LOGGER.debug("Found a Neoplug named: %s, added as a switch", device.name)
+            elif device.timeclock:
+                _LOGGER.debug("Found a Neostat configured in timer mode named: %s, added as a switch", device.name)
+            else:
+                name = device.name
+                temperature_unit = device.temperature_unit
+                away = device.away
+                current_temperature = device.current_temperature
+                set_temperature = device.target_temperature
+                on_hold = device.on_hold
+
+                _LOGGER.info("Thermostat Name: %s ", name)
+                _LOGGER.info("Thermostat Away Mode: %s ", away)
+                _LOGGER.info("Thermostat Current Temp: %s ", current_temperature)
+                _LOGGER.info("Thermostat Set Temp: %s ", set_temperature)
+                _LOGGER.info("Thermostat Unit Of Measurement: %s ", temperature_unit)
+                _LOGGER.info("Thermostat is on hold: %r ", on_hold)
+
+                thermostats.append(HeatmiserNeostat(temperature_unit, away, coordinator, name))
+
+        if thermostats:
+            _LOGGER.info("Adding Thermostats: %s ", thermostats)
+            async_add_entities(thermostats)
+
+    # Entities are seeded from the snapshot saved by the last run, or else
+    # from one INFO snapshot. The first background poll brings them current.
+    if (not await coordinator.async_restore()
+            and not await coordinator.async_bootstrap()):
+        _LOGGER.warning("Neo-hub %s:%s did not answer, its thermostats will "
+                        "be added once it does", host, port)
+    async_add_new_devices()
+    coordinator.add_listener(async_add_new_devices)
+
+    # One poll per cycle for the whole hub, entities are fed from it.
+    coordinator.async_start(hass)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, coordinator.async_stop)
+
+    # Neoplugs and timeclocks as switches, and diagnostic sensors of the
+    # hub's performance, all fed from the same polls.
+    for platform in ("switch", "sensor"):
+        hass.async_create_task(async_load_platform(
+            hass, platform, COMPONENT_DOMAIN, {CONF_HOST: host, CONF_PORT: port},
+            hass.data[DATA_CONFIG]))
+
+
+def check_response(service, response, expected):
+    """Return True if a hub response reports the expected result."""
+    _LOGGER.info("%s response: %s ", service, response)
+    try:
+        return response['result'] == expected
+    except Exception as e:
+        _LOGGER.info('Failed to parse response')
+    return False
+
+
+async def async_send_commands(thermostats, command, values):
+    """Send a command to many thermostats, batched per hub and value.
+
+    values holds the command value of each thermostat, returns the hub
+    response of each thermostat.
+    """
+    return await asyncio.gather(*[
+        thermostat.coordinator.async_batched_command(
+            command, value, thermostat.name)
+        for thermostat, value in zip(thermostats, values)
+    ])
+
+
+def group_by_hub(thermostats):
+    """Return the names of the thermostats keyed by their hub coordinator."""
+    coordinators = {}
+    for thermostat in thermostats:
+        coordinators.setdefault(thermostat.coordinator, []).append(thermostat.name)
+    return coordinators
+
+
+async def async_refresh_hubs(thermostats):
+    """Verify the commands sent to the thermostats, one refresh per hub."""
+    await asyncio.gather(*[
+        coordinator.async_request_refresh(names)
+        for coordinator, names in group_by_hub(thermostats).items()
+    ])
 
-    _LOGGER.info("Adding Thermostats: %s " % thermostats)
-    add_devices(thermostats)
 
 async def async_handle_hold_temperature_service(hass, call):
     """Handle hold temp service calls."""
-    entity_id = call.data[ATTR_ENTITY_ID]
+    entity_ids = call.data[ATTR_ENTITY_ID]
     hold_temperature = int(float(call.data["hold_temperature"]))
     hold_hours = int(float(call.data["hold_hours"]))
     hold_minutes = int(float(call.data["hold_minutes"]))
-    thermostat = get_entity_from_domain(hass, DOMAIN, entity_id)
-    response = thermostat.json_request({"HOLD":[{"temp":hold_temperature, "id":"hass","hours":hold_hours,"minutes":hold_minutes}, str(thermostat.name)]})
-    
-    if response:
-        _LOGGER.info("hold_temperature response: %s " % response)
-        # Need check for success here
+    thermostats = get_entities_from_domain(hass, DOMAIN, entity_ids)
+    hold = {"temp":hold_temperature, "id":"hass","hours":hold_hours,"minutes":hold_minutes}
+    responses = await async_send_commands(thermostats, "HOLD", [hold] * len(thermostats))
+
+    for thermostat, response in zip(thermostats, responses):
+        if not response:
+            continue
         # {'result': 'temperature on hold'}
-        success = False
-        try:
-            if response['result'] == 'temperature on hold':
-                success = True
-        except Exception as e:
-            _LOGGER.info('Failed to parse response')
-        if success:
+        if check_response("hold_temperature", response, 'temperature on hold'):
             if hold_hours == 0 and hold_minutes == 0 :
-                thermostat._on_hold = STATE_OFF
-                thermostat._hold_time ='0:00'
-            if hold_hours > 0 or hold_minutes > 0 :
-                thermostat._on_hold = STATE_ON
-                thermostat._hold_time = str(hold_hours) + ':' + str(hold_minutes).zfill(2)
-                thermostat._target_temperature = hold_temperature
-
-            thermostat._hold_temperature = hold_temperature
-        thermostat.update_without_throttle = True
-        thermostat.schedule_update_ha_state()
-        if hold_hours == 0 and hold_minutes == 0 :
-            thermostat.update()
+                thermostat.coordinator.apply_optimistic(
+                    thermostat.name, on_hold=False, hold_time='0:00',
+                    hold_temperature=hold_temperature)
+            else:
+                thermostat.coordinator.apply_optimistic(
+                    thermostat.name, on_hold=True,
+                    hold_time=str(hold_hours) + ':' + str(hold_minutes).zfill(2),
+                    hold_temperature=hold_temperature,
+                    target_temperature=hold_temperature)
+    await async_refresh_hubs(thermostats)
 
 async def async_handle_cancel_hold_service(hass, call):
     """Handle cancel hold service calls."""
-    entity_id = call.data[ATTR_ENTITY_ID]
-    thermostat = get_entity_from_domain(hass, DOMAIN, entity_id)
-    hold_temperature = int(float(thermostat._hold_temperature))
-    response = thermostat.json_request({"HOLD":[{"temp":hold_temperature, "id":"hass","hours":0,"minutes":0}, str(thermostat.name)]})
-
-    if response:
-        _LOGGER.info("cancel_hold response: %s " % response)
-        # Need check for success here
+    entity_ids = call.data[ATTR_ENTITY_ID]
+    thermostats = get_entities_from_domain(hass, DOMAIN, entity_ids)
+    holds = [
+        {"temp":int(float(thermostat._hold_temperature)), "id":"hass","hours":0,"minutes":0}
+        for thermostat in thermostats
+    ]
+    responses = await async_send_commands(thermostats, "HOLD", holds)
+
+    for thermostat, response in zip(thermostats, responses):
+        if not response:
+            continue
         # {'result': 'temperature on hold'}
-        success = False
-        try:
-            if response['result'] == 'temperature on hold':
-                success = True
-        except Exception as e:
-            _LOGGER.info('Failed to parse response')
-        if success:
-            thermostat._on_hold = STATE_OFF
-            thermostat._hold_time ='0:00'
-        thermostat.update_without_throttle = True
-        thermostat.schedule_update_ha_state()
-        thermostat.update()
+        if check_response("cancel_hold", response, 'temperature on hold'):
+            thermostat.coordinator.apply_optimistic(
+                thermostat.name, on_hold=False, hold_time='0:00')
+    await async_refresh_hubs(thermostats)
 
 
 async def async_handle_activate_frost_service(hass, call):
     """Handle activate frost service calls."""
-    entity_id = call.data[ATTR_ENTITY_ID]
-    thermostat = get_entity_from_domain(hass, DOMAIN, entity_id)
-    response = thermostat.json_request({"FROST_ON": str(thermostat.name)})
+    entity_ids = call.data[ATTR_ENTITY_ID]
+    thermostats = get_entities_from_domain(hass, DOMAIN, entity_ids)
+    responses = await async_send_commands(thermostats, "FROST_ON", [None] * len(thermostats))
 
-    if response:
-        _LOGGER.info("activate_frost response: %s " % response)
-        # Need check for success here
+    for thermostat, response in zip(thermostats, responses):
+        if not response:
+            continue
         # {"result":"frost on"}
-        success = False
-        try:
-            if response['result'] == 'frost on':
-                success = True
-        except Exception as e:
-            _LOGGER.info('Failed to parse response')
-        if success:
-            thermostat._on_standby = STATE_ON
-            thermostat._target_temperature = thermostat._frost_temperature
-        thermostat.update_without_throttle = True
-        thermostat.schedule_update_ha_state()
-        if not success :
-            thermostat.update()
+        if check_response("activate_frost", response, 'frost on'):
+            # The hub leaves the set temperature alone on FROST_ON, only
+            # the standby flag is expected to change.
+            thermostat.coordinator.apply_optimistic(thermostat.name, standby=True)
+    await async_refresh_hubs(thermostats)
 
 async def async_handle_cancel_frost_service(hass, call):
     """Handle cancel frost service calls."""
-    entity_id = call.data[ATTR_ENTITY_ID]
-    thermostat = get_entity_from_domain(hass, DOMAIN, entity_id)
-    response = thermostat.json_request({"FROST_OFF": str(thermostat.name)})
+    entity_ids = call.data[ATTR_ENTITY_ID]
+    thermostats = get_entities_from_domain(hass, DOMAIN, entity_ids)
+    responses = await async_send_commands(thermostats, "FROST_OFF", [None] * len(thermostats))
 
-    if response:
-        _LOGGER.info("cancel_frost response: %s " % response)
-        # Need check for success here
+    for thermostat, response in zip(thermostats, responses):
+        if not response:
+            continue
         #{"result":"frost off"}
-        success = False
-        try:
-            if response['result'] == 'frost off':
-                success = True
-        except Exception as e:
-            _LOGGER.info('Failed to parse response')
-        if success:
-            thermostat._on_standby = STATE_OFF
-        thermostat.update_without_throttle = True
-        thermostat.schedule_update_ha_state()
-        thermostat.update()
+        if check_response("cancel_frost", response, 'frost off'):
+            thermostat.coordinator.apply_optimistic(thermostat.name, standby=False)
+    await async_refresh_hubs(thermostats)
 
 
 async def async_handle_set_frost_temp_service(hass, call):
     """Handle set frost temp service calls."""
-    entity_id = call.data[ATTR_ENTITY_ID]
-    thermostat = get_entity_from_domain(hass, DOMAIN, entity_id)
+    entity_ids = call.data[ATTR_ENTITY_ID]
+    thermostats = get_entities_from_domain(hass, DOMAIN, entity_ids)
     frost_temperature = int(float(call.data["frost_temperature"]))
-    response = thermostat.json_request({"SET_FROST": [frost_temperature, str(thermostat.name)]})
+    responses = await async_send_commands(thermostats, "SET_FROST", [frost_temperature] * len(thermostats))
 
-    if response:
-        _LOGGER.info("set_frost_temp response: %s " % response)
-        # Need check for success here
+    for thermostat, response in zip(thermostats, responses):
+        if not response:
+            continue
         # {"result":"temperature was set"}
-        success = False
-        try:
-            if response['result'] == 'temperature was set':
-                success = True
-        except Exception as e:
-            _LOGGER.info('Failed to parse response')
-        if success:
-            thermostat._frost_temperature = frost_temperature
-        thermostat.update_without_throttle = True
-        thermostat.schedule_update_ha_state()
-        if not success :
-            thermostat.update()
-
-async def async_handle_neo_update_service(hass, call, host, port):
-    """Handle neo update service calls."""
-    hub = HeatmiserNeostat(TEMP_CELSIUS, False, host, port)
-    hub.update()
+        if check_response("set_frost_temp", response, 'temperature was set'):
+            thermostat.coordinator.apply_optimistic(
+                thermostat.name, frost_temperature=frost_temperature)
+    await async_refresh_hubs(thermostats)
+
+async def async_handle_neo_update_service(hass, call):
+    """Handle neo update service calls, polls the hubs of the given thermostats or every hub."""
+    if ATTR_ENTITY_ID in call.data:
+        thermostats = get_entities_from_domain(hass, DOMAIN, call.data[ATTR_ENTITY_ID])
+        coordinators = group_by_hub(thermostats)
+    else:
+        coordinators = hass.data[DATA_COORDINATORS].values()
+    await asyncio.gather(*[
+        coordinator.async_update(force=True) for coordinator in coordinators
+    ])
+
+
+def thermostats_by_hub(hass, call):
+    """Return the thermostat names of a service call, or of every thermostat,
+    keyed by their hub coordinator."""
+    if ATTR_ENTITY_ID in call.data:
+        thermostats = get_entities_from_domain(hass, DOMAIN, call.data[ATTR_ENTITY_ID])
+        return group_by_hub(thermostats)
+    return {
+        coordinator: [
+            device.name for device in coordinator.devices.values()
+            if not device.neoplug and not device.timeclock
+        ]
+        for coordinator in hass.data[DATA_COORDINATORS].values()
+    }
+
+
+async def async_handle_read_profiles_service(hass, call):
+    """Handle read profiles service calls.
+
+    Reads the comfort level profiles of the given thermostats, or of every
+    thermostat, from the cache or with one request per hub, and fires an
+    event per hub holding the profile of each zone.
+    """
+    coordinators = list(thermostats_by_hub(hass, call).items())
+    profiles = await asyncio.gather(*[
+        coordinator.async_read_profiles(names, call.data["refresh"])
+        for coordinator, names in coordinators
+    ])
+    for (coordinator, names), zones in zip(coordinators, profiles):
+        hass.bus.async_fire(EVENT_PROFILES, {
+            CONF_HOST: coordinator.host,
+            CONF_PORT: coordinator.port,
+            "zones": zones,
+        })
+
+
+async def async_handle_set_profile_service(hass, call):
+    """Handle set profile service calls, only zones with a different profile are written."""
+    profile = call.data["profile"]
+    coordinators = thermostats_by_hub(hass, call)
+    written = await asyncio.gather(*[
+        coordinator.async_write_profiles({name: profile for name in names})
+        for coordinator, names in coordinators.items()
+    ])
+    _LOGGER.info("set_profile wrote the profile of: %s",
+                 [name for names in written for name in names])
+
+
+async def async_handle_get_log_service(hass, call, command, event_type):
+    """Handle get temperature log and get hours run service calls.
+
+    Reads the log of the given thermostats, or of every thermostat, with one
+    request per hub and fires an event per hub holding the log of each zone.
+    """
+    coordinators = list(thermostats_by_hub(hass, call).items())
+    logs = await asyncio.gather(*[
+        coordinator.logs.async_get(command, names)
+        for coordinator, names in coordinators
+    ])
+    for (coordinator, names), zones in zip(coordinators, logs):
+        hass.bus.async_fire(event_type, {
+            CONF_HOST: coordinator.host,
+            CONF_PORT: coordinator.port,
+            "zones": zones,
+        })
+
+
+async def async_handle_dump_trace_service(hass, call):
+    """Handle dump trace service calls, writes the recent frames of each hub to a file."""
+    for coordinator in hass.data[DATA_COORDINATORS].values():
+        client = coordinator.client
+        path = hass.config.path(TRACE_FILE.format(client.host, client.port))
+        frames = client.tracer.dump()
+
+        def write_trace(path=path, frames=frames):
+            with open(path, "w") as trace_file:
+                json.dump(frames, trace_file, indent=2)
+
+        await hass.async_add_executor_job(write_trace)
+        _LOGGER.info("Wrote %d Neo-hub frames to %s", len(frames), path)
 
 
 class HeatmiserNeostat(ClimateDevice):
     """ Represents a Heatmiser Neostat thermostat. """
-    def __init__(self, unit_of_measurement, away, host, port, name="Null"):
+    def __init__(self, unit_of_measurement, away, coordinator, name="Null"):
         self._name = name
         self._unit_of_measurement = unit_of_measurement
         self._away = away
-        self._host = host
-        self._port = port
+        self._coordinator = coordinator
+        self._remove_listener = None
+        self._history = ZoneHistory(
+            min_interval=coordinator.scheduler.fast_interval)
+        self._metrics = None
+        self._update_pending = False
         #self._type = type Neostat vs Neostat-e
         self._hvac_action = None
         self._hvac_mode = None
@@ -390,7 +626,7 @@ class HeatmiserNeostat(ClimateDevice):
         self._hvac_modes = hvac_modes
         self._support_flags = SUPPORT_FLAGS
         self._support_flags = self._support_flags | SUPPORT_TARGET_TEMPERATURE
-        self.update()
+        self._update_from_snapshot()
 
     @property
     def supported_features(self):
@@ -399,8 +635,58 @@ class HeatmiserNeostat(ClimateDevice):
 
     @property
     def should_poll(self):
-        """ No polling needed for a demo thermostat. """
-        return True
+        """ No polling needed, the hub coordinator pushes updates. """
+        return False
+
+    @property
+    def available(self):
+        """ Return False while the hub is unreachable. """
+        return self._coordinator.available
+
+    @property
+    def coordinator(self):
+        """ Return the coordinator polling this thermostat's hub. """
+        return self._coordinator
+
+    async def async_added_to_hass(self):
+        """ Subscribe to hub snapshots. """
+        remove_update = self._coordinator.add_listener(
+            self._handle_coordinator_update, self._name)
+        remove_poll = self._coordinator.add_listener(self._handle_poll)
+
+        def remove_listener():
+            remove_update()
+            remove_poll()
+
+        self._remove_listener = remove_listener
+
+    async def async_will_remove_from_hass(self):
+        """ Unsubscribe from hub snapshots. """
+        if self._remove_listener:
+            self._remove_listener()
+            self._remove_listener = None
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Refresh from the new hub snapshot. """
+        self._update_pending = True
+        self.async_schedule_update_ha_state(True)
+
+    @callback
+    def _handle_poll(self):
+        """ Publish the heating metrics when they moved on a steady poll. """
+        if not self._update_pending and self._heating_metrics() != self._metrics:
+            self.async_schedule_update_ha_state()
+
+    def _heating_metrics(self):
+        """ Return the metrics derived from this thermostat's history. """
+        now = time.time()
+        return {
+            "duty_cycle_1h": self._history.duty_cycle(3600, now),
+            "duty_cycle_24h": self._history.duty_cycle(86400, now),
+            "heat_rate": self._history.heat_rate,
+            "time_to_target": self._history.time_to_target(),
+        }
 
     @property
     def name(self):
@@ -492,6 +778,7 @@ class HeatmiserNeostat(ClimateDevice):
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
+        self._metrics = self._heating_metrics()
         return {
             ATTR_ATTRIBUTION: ATTRIBUTION,
             "on_hold": self._on_hold,
@@ -501,6 +788,7 @@ class HeatmiserNeostat(ClimateDevice):
             "frost_temperature": self._frost_temperature,
             "switching_differential": self._switching_differential,
             "output_delay": self._output_delay,
+            **self._metrics,
         }
 
     # @property
@@ -514,125 +802,80 @@ class HeatmiserNeostat(ClimateDevice):
     #     return self._preset_modes
 
 
-    def set_temperature(self, **kwargs):
-        """ Set new target temperature. """
-        response = self.json_request({"SET_TEMP": [int(kwargs.get(ATTR_TEMPERATURE)), self._name]})
+    async def async_set_temperature(self, **kwargs):
+        """ Set new target temperature through the hub's write queue. """
+        temperature = int(kwargs.get(ATTR_TEMPERATURE))
+        # Show the new target straight away, the write itself is delayed
+        # so a dragged slider only sends its final value.
+        self._coordinator.apply_optimistic(
+            self._name, target_temperature=temperature)
+        response = await self._coordinator.async_set_temperature(
+            self._name, temperature)
         if response:
-            _LOGGER.info("set_temperature response: %s " % response)
-            # Need check for success here
+            _LOGGER.info("set_temperature response: %s ", response)
             # {'result': 'temperature was set'}
+        await self._coordinator.async_request_refresh([self._name])
 
-    def set_temperature_e(self, **kwargs):
+    async def async_set_temperature_e(self, **kwargs):
         """ Set new target temperature. """
-        response = self.json_request({"SET_TEMP": [int(kwargs.get(ATTR_TEMPERATURE)), self._name]})
+        response = await self.async_json_request({"SET_TEMP": [int(kwargs.get(ATTR_TEMPERATURE)), self._name]})
         if response:
-            _LOGGER.info("set_temperature response: %s " % response)
+            _LOGGER.info("set_temperature response: %s ", response)
             # Need check for success here
             # {'result': 'temperature was set'}
 
-    def update(self):
-        """ Get Updated Info. """
+    async def async_update(self):
+        """ Get Updated Info from the last hub snapshot. """
+        self._update_pending = False
+        self._update_from_snapshot()
+
+    def _update_from_snapshot(self):
+        """ Copy this thermostat's values out of the hub snapshot. """
         if self.update_without_throttle:
             self.update_without_throttle = False
         _LOGGER.debug("Entered update(self)")
-        response = self.json_request({"INFO": 0})
-        engResponse = self.json_request({"ENGINEERS_DATA": 0})
-        if response:
-            # Add handling for mulitple thermostats here
-            _LOGGER.debug("update() json response: %s " % response)
-            # self._name = device['device']
-            for device in response['devices']:
-              if self._name == device['device']:
-                tmptempfmt = device["TEMPERATURE_FORMAT"]
-                if (tmptempfmt == False) or (tmptempfmt.upper() == "C"):
-                  self._temperature_unit = TEMP_CELSIUS
-                else:
-                  self._temperature_unit = TEMP_FAHRENHEIT
-                self._away = device['AWAY']
-                self._target_temperature =  round(float(device["CURRENT_SET_TEMPERATURE"]), 2)
-                self._current_temperature = round(float(device["CURRENT_TEMPERATURE"]), 2)
-                self._current_humidity = round(float(device["HUMIDITY"]), 2)
-                if device["TEMP_HOLD"]:
-                    self._on_hold = STATE_ON
-                else:
-                    self._on_hold = STATE_OFF
-                self._hold_temperature = round(float(device["HOLD_TEMPERATURE"]), 2)
-                self._hold_time = device["HOLD_TIME"]
-                if device["STANDBY"]:
-                    self._on_standby = STATE_ON
-                else:
-                    self._on_standby = STATE_OFF
-
-                # Figure out the current mode based on whether cooling is enabled - should verify that this is correct
-                if device["COOLING_ENABLED"] == True:
-                    self._hvac_mode = HVAC_MODE_COOL
-                else:
-                    self._hvac_mode = HVAC_MODE_HEAT
-
-                # Figure out current action based on Heating / Cooling flags
-                if device["HEATING"] == True:
-                    self._hvac_action = CURRENT_HVAC_HEAT
-                    _LOGGER.debug("Heating")
-                elif device["COOLING"] == True:
-                    self._hvac_action = CURRENT_HVAC_COOL
-                    _LOGGER.debug("Cooling")
-                else:
-                    self._hvac_action = CURRENT_HVAC_IDLE
-                    _LOGGER.debug("Idle")
-            if engResponse:
-                _LOGGER.debug("update() json engResponse: %s " % engResponse)
-                self._frost_temperature = round(float(engResponse[device["device"]]["FROST TEMPERATURE"]), 2)
-                self._switching_differential = round(float(engResponse[device["device"]]["SWITCHING DIFFERENTIAL"]), 2)
-                self._output_delay = round(float(engResponse[device["device"]]["OUTPUT DELAY"]), 2)
-
-
-    def json_request(self, request=None, wait_for_response=False):
-        """ Communicate with the json server. """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-
-        try:
-            sock.connect((self._host, self._port))
-        except OSError:
-            sock.close()
-            return False
-
-        if not request:
-            # no communication needed, simple presence detection returns True
-            sock.close()
-            return True
-
-        _LOGGER.debug("json_request: %s " % request)
-
-        sock.send(bytearray(json.dumps(request) + "\0\r", "utf-8"))
-        try:
-            buf = sock.recv(4096)
-        except socket.timeout:
-            # something is wrong, assume it's offline
-            sock.close()
-            return False
-
-        # read until a newline or timeout
-        buffering = True
-        while buffering:
-            if "\n" in str(buf, "utf-8"):
-                response = str(buf, "utf-8").split("\n")[0]
-                buffering = False
+        device = self._coordinator.device(self._name)
+        if device:
+            self._temperature_unit = device.temperature_unit
+            self._away = device.away
+            self._target_temperature = device.target_temperature
+            self._current_temperature = device.current_temperature
+            self._current_humidity = device.current_humidity
+            if device.on_hold:
+                self._on_hold = STATE_ON
             else:
-                try:
-                    more = sock.recv(4096)
-                except socket.timeout:
-                    more = None
-                if not more:
-                    buffering = False
-                    response = str(buf, "utf-8")
-                else:
-                    buf += more
-
-        sock.close()
-
-        response = response.rstrip('\0')
-
-        _LOGGER.debug("json_response: %s " % response)
+                self._on_hold = STATE_OFF
+            self._hold_temperature = device.hold_temperature
+            self._hold_time = device.hold_time
+            if device.standby:
+                self._on_standby = STATE_ON
+            else:
+                self._on_standby = STATE_OFF
 
-        return json.loads(response, strict=False)
+            # Figure out the current mode based on whether cooling is enabled - should verify that this is correct
+            if device.cooling_enabled:
+                self._hvac_mode = HVAC_MODE_COOL
+            else:
+                self._hvac_mode = HVAC_MODE_HEAT
+
+            # Figure out current action based on Heating / Cooling flags
+            if device.heating:
+                self._hvac_action = CURRENT_HVAC_HEAT
+                _LOGGER.debug("Heating")
+            elif device.cooling:
+                self._hvac_action = CURRENT_HVAC_COOL
+                _LOGGER.debug("Cooling")
+            else:
+                self._hvac_action = CURRENT_HVAC_IDLE
+                _LOGGER.debug("Idle")
+            self._history.append(
+                time.time(), device.current_temperature,
+                device.target_temperature, device.heating)
+            if device.frost_temperature is not None:
+                self._frost_temperature = device.frost_temperature
+                self._switching_differential = device.switching_differential
+                self._output_delay = device.output_delay
+
+    async def async_json_request(self, request=None):
+        """ Communicate with the json server of this thermostat's hub. """
+        return await self._coordinator.async_json_request(request)
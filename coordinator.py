@@ -0,0 +1,604 @@
+"""
+homeassistant.components.climate.heatmiserneo.coordinator
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Shared Neo-hub poller. The hub is queried once per cycle and the result
+is handed to every entity, so entities never talk to the hub themselves.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .device import NeoDevice, index_devices, index_live_devices
+from .neohub import TRACE_SAMPLE_RATE, NeoHubClient
+from .zonelog import ZoneLogs
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_CLIENTS = "heatmiserneo_clients"
+DATA_COORDINATORS = "heatmiserneo_coordinators"
+
+# Default seconds between polls of a hub.
+DEFAULT_INTERVAL = 60
+
+# Seconds between polls for a while after a command or a heating change.
+FAST_INTERVAL = 10
+FAST_WINDOW = 120
+
+# Polls slow down by this factor while nothing changes, up to MAX_INTERVAL.
+STABLE_FACTOR = 1.5
+MAX_INTERVAL = 300
+
+# Longest wait between attempts while the hub is unreachable.
+MAX_BACKOFF = 600
+
+# Seconds target temperature writes are held so rapid changes coalesce.
+WRITE_DELAY = 1
+
+# Seconds a changed snapshot waits before it is written to disk.
+SAVE_DELAY = 30
+
+# Optimistic values that are not compared with the hub, they keep moving.
+UNVERIFIED_FIELDS = ("hold_time",)
+
+# Sections of the hub state that GET_LIVE_DATA leaves out, and the
+# timestamps of GET_LIVE_DATA that advance when they change.
+LIVE_SECTIONS = {
+    "GET_ENGINEERS": ("TIMESTAMP_ENGINEERS", "TIMESTAMP_DEVICE_LISTS"),
+    "GET_SYSTEM": ("TIMESTAMP_SYSTEM",),
+}
+
+# GET_LIVE_DATA timestamp that advances when a comfort level profile is
+# changed, from the hub or another app.
+PROFILES_TIMESTAMP = "TIMESTAMP_PROFILE_COMFORT_LEVELS"
+
+# Times of day in a comfort level profile, the hub zero pads the hours.
+PROFILE_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+
+def get_client(hass, host, port, trace_sample_rate=TRACE_SAMPLE_RATE):
+    """ Return the shared client of a hub, creating it on first use. """
+    clients = hass.data.get(DATA_CLIENTS)
+    if clients is None:
+        clients = hass.data[DATA_CLIENTS] = {}
+
+        @callback
+        def close_clients(event):
+            for client in clients.values():
+                client.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, close_clients)
+
+    if (host, port) not in clients:
+        clients[(host, port)] = NeoHubClient(
+            host, port, trace_sample_rate=trace_sample_rate)
+    return clients[(host, port)]
+
+
+def valid_section(command, response):
+    """ Return True if response is a usable reply to a LIVE_SECTIONS command. """
+    if not isinstance(response, dict) or "error" in response:
+        return False
+    if command == "GET_ENGINEERS":
+        return all(isinstance(zone, dict) for zone in response.values())
+    return "CORF" in response
+
+
+def normalise_profile(value):
+    """ Return a comfort level profile in one canonical form.
+
+    The hub answers READ_COMFORT_LEVELS with its own spelling of what was
+    written: other key case, zero padded times, temperatures as floats.
+    """
+    if isinstance(value, dict):
+        return {str(key).lower(): normalise_profile(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalise_profile(item) for item in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 1)
+    text = str(value).strip()
+    match = PROFILE_TIME.match(text)
+    if match:
+        return "%02d:%s" % (int(match.group(1)), match.group(2))
+    try:
+        return round(float(text), 1)
+    except ValueError:
+        return text.lower()
+
+
+def build_command(command, value, names):
+    """ Build a hub command addressed to one or many devices. """
+    target = names[0] if len(names) == 1 else list(names)
+    if value is None:
+        return {command: target}
+    return {command: [value, target]}
+
+
+class PollScheduler:
+    """ Picks the delay before the next hub poll. """
+
+    def __init__(self, interval, fast_interval=FAST_INTERVAL,
+                 fast_window=FAST_WINDOW, max_interval=MAX_INTERVAL,
+                 max_backoff=MAX_BACKOFF):
+        self._base = interval
+        self._fast_interval = min(fast_interval, interval)
+        self._fast_window = fast_window
+        self._max_interval = max(max_interval, interval)
+        self._max_backoff = max(max_backoff, interval)
+        self._interval = interval
+        self._fast_until = 0
+        self._failures = 0
+
+    @property
+    def fast_interval(self):
+        """ Return the shortest delay between two scheduled polls. """
+        return self._fast_interval
+
+    def activity(self, now=None):
+        """ Poll quickly for a while, something is happening. """
+        now = time.monotonic() if now is None else now
+        self._fast_until = now + self._fast_window
+        self._interval = self._base
+
+    def next_delay(self, success, changed, now=None):
+        """ Return the seconds to wait after a poll with this outcome. """
+        now = time.monotonic() if now is None else now
+        if not success:
+            self._failures += 1
+            return min(self._base * 2 ** self._failures, self._max_backoff)
+        self._failures = 0
+        if changed:
+            self._interval = self._base
+        else:
+            self._interval = min(self._interval * STABLE_FACTOR,
+                                 self._max_interval)
+        if now < self._fast_until:
+            return self._fast_interval
+        return self._interval
+
+
+class NeoHubCoordinator:
+    """ Polls a Neo-hub and fans the snapshot out to its entities. """
+
+    def __init__(self, client, deadband=0, interval=DEFAULT_INTERVAL,
+                 store=None, log_store=None):
+        self.client = client
+        self.logs = ZoneLogs(client, log_store)
+        self._store = store
+        self.deadband = deadband
+        self.scheduler = PollScheduler(interval)
+        self._hass = None
+        self._unsub_poll = None
+        self._batches = {}
+        self._pending_temperatures = {}
+        self._temperatures_written = None
+        # Optimistic values per device, and the devices whose command has
+        # completed so the next poll can verify them.
+        self._expected = {}
+        self._verify = set()
+        self._refresh = None
+        self._poll_lock = asyncio.Lock()
+        self.host = client.host
+        self.port = client.port
+        self.info = None
+        self.engineers_data = None
+        # None until the hub answered either GET_LIVE_DATA or INFO.
+        self.live_data_supported = None
+        self.live_data = None
+        self._sections = {}
+        self._section_versions = {}
+        # Comfort level profiles read from the hub, until they are written.
+        self.profiles = {}
+        self._profiles_version = None
+        self.devices = {}
+        self._listeners = []
+        # Availability the listeners were last told about, commands can
+        # open or close the circuit between polls.
+        self._published_available = True
+
+    async def async_json_request(self, request=None):
+        """ Send a command to this hub, polls speed up for a while. """
+        response = await self.client.async_json_request(request)
+        self.scheduler.activity()
+        self._schedule_poll(FAST_INTERVAL)
+        return response
+
+    async def async_batched_command(self, command, value, name):
+        """ Send a device command, returns the hub response.
+
+        Identical commands for other devices queued in the same loop
+        iteration are merged into the same hub request.
+        """
+        key = (command, json.dumps(value, sort_keys=True))
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = (
+                [], asyncio.get_event_loop().create_future())
+            asyncio.ensure_future(self._async_send_batch(command, value, key))
+        batch[0].append(name)
+        return await asyncio.shield(batch[1])
+
+    async def _async_send_batch(self, command, value, key):
+        """ Send a queued batch once every caller of this iteration joined. """
+        await asyncio.sleep(0)
+        names, future = self._batches.pop(key)
+        try:
+            response = await self.async_json_request(
+                build_command(command, value, names))
+        except Exception as err:
+            future.set_exception(err)
+        else:
+            future.set_result(response)
+
+    async def async_set_temperature(self, name, temperature):
+        """ Queue a target temperature write, returns the hub response.
+
+        A later write for the same zone within WRITE_DELAY replaces this
+        one, and every zone queued in that window is sent together with one
+        request per distinct temperature.
+        """
+        self._pending_temperatures[name] = temperature
+        written = self._temperatures_written
+        if written is None:
+            loop = asyncio.get_event_loop()
+            written = self._temperatures_written = loop.create_future()
+            loop.call_later(
+                WRITE_DELAY, asyncio.ensure_future,
+                self._async_write_temperatures())
+        responses = await asyncio.shield(written)
+        return responses.get(name)
+
+    async def _async_write_temperatures(self):
+        """ Send the queued target temperatures. """
+        pending, self._pending_temperatures = self._pending_temperatures, {}
+        written, self._temperatures_written = self._temperatures_written, None
+        zones = {}
+        for name, temperature in pending.items():
+            zones.setdefault(temperature, []).append(name)
+        responses = {}
+        try:
+            for temperature, names in zones.items():
+                response = await self.async_json_request(
+                    build_command("SET_TEMP", temperature, names))
+                for name in names:
+                    responses[name] = response
+        except Exception as err:
+            written.set_exception(err)
+        else:
+            written.set_result(responses)
+
+    async def async_read_profiles(self, names, refresh=False):
+        """ Return the comfort level profile of each zone.
+
+        Zones whose profile is not cached, or every zone with refresh, are
+        read together in one request.
+        """
+        missing = [name for name in names if refresh or name not in self.profiles]
+        if missing:
+            response = await self.client.async_json_request(
+                {"READ_COMFORT_LEVELS": missing})
+            if response:
+                for name in missing:
+                    if name in response:
+                        self.profiles[name] = response[name]
+        return {name: self.profiles.get(name) for name in names}
+
+    async def async_write_profiles(self, profiles):
+        """ Write the profile wanted for each zone, returns the zones written.
+
+        Zones whose cached profile already matches are skipped, the others
+        are sent with one request per distinct profile. Written zones are
+        dropped from the cache so the next read comes from the hub.
+        """
+        current = await self.async_read_profiles(list(profiles))
+        zones = {}
+        for name, profile in profiles.items():
+            key = json.dumps(normalise_profile(profile), sort_keys=True)
+            if (current[name] is not None and key == json.dumps(
+                    normalise_profile(current[name]), sort_keys=True)):
+                continue
+            zones.setdefault(key, (profile, []))[1].append(name)
+        written = []
+        for profile, names in zones.values():
+            response = await self.async_json_request(
+                build_command("SET_COMFORT_LEVELS", profile, names))
+            for name in names:
+                self.profiles.pop(name, None)
+            if response and "error" not in response:
+                written.extend(names)
+            else:
+                _LOGGER.warning("Neo-hub %s:%s did not accept the profile of "
+                                "%s: %s", self.host, self.port, names, response)
+        if written and self.live_data_supported:
+            # The write advanced the profiles timestamp. Note the new one so
+            # the next poll keeps the profiles of the other zones.
+            live_data = await self.client.async_json_request({"GET_LIVE_DATA": 0})
+            if live_data and PROFILES_TIMESTAMP in live_data:
+                self._profiles_version = live_data[PROFILES_TIMESTAMP]
+        return written
+
+    async def async_restore(self):
+        """ Load the snapshot saved by a previous run, returns success. """
+        if self._store is None:
+            return False
+        data = await self._store.async_load()
+        if not data:
+            return False
+        fields = data["fields"]
+        devices = {}
+        for values in data["devices"]:
+            device = NeoDevice.from_values(fields, values)
+            devices[device.name] = device
+        self.devices = devices
+        _LOGGER.debug("Restored %d devices of Neo-hub %s:%s",
+                      len(devices), self.host, self.port)
+        return bool(devices)
+
+    def _snapshot_data(self):
+        """ Return the snapshot in the compact form it is saved in. """
+        return {
+            "fields": list(NeoDevice.__slots__),
+            "devices": [device.as_values() for device in self.devices.values()],
+        }
+
+    async def async_bootstrap(self):
+        """ Build the first snapshot from INFO alone, returns success.
+
+        ENGINEERS_DATA is left to the first background poll so setup only
+        waits for a single round trip.
+        """
+        info = await self.client.async_json_request({"INFO": 0})
+        if not info:
+            return False
+        self.info = info
+        self.devices = index_devices(info, self.engineers_data)
+        return True
+
+    def async_start(self, hass):
+        """ Start polling the hub on the adaptive schedule. """
+        self._hass = hass
+        # Poll straight away in the background to complete the snapshot.
+        self._schedule_poll(0)
+
+    @callback
+    def async_stop(self, event=None):
+        """ Stop polling the hub. """
+        if self._unsub_poll is not None:
+            self._unsub_poll()
+            self._unsub_poll = None
+        self._hass = None
+
+    def _schedule_poll(self, delay):
+        """ Move the next poll to delay seconds from now. """
+        if self._hass is None:
+            return
+        if self._unsub_poll is not None:
+            self._unsub_poll()
+        self._unsub_poll = async_call_later(
+            self._hass, delay, self._async_scheduled_update)
+
+    async def _async_scheduled_update(self, now):
+        """ Run a scheduled poll. """
+        self._unsub_poll = None
+        await self.async_update()
+
+    def add_listener(self, update_callback, name=None):
+        """ Register a poll callback, returns a remover.
+
+        With a device name the callback only runs when that device changed,
+        otherwise it runs after every poll.
+        """
+        listener = (name, update_callback)
+        self._listeners.append(listener)
+
+        def remove_listener():
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return remove_listener
+
+    @property
+    def available(self):
+        """ Return False while the hub is known to be unreachable. """
+        return self.client.health.available
+
+    def device(self, name):
+        """ Return the record of a device from the last snapshot. """
+        return self.devices.get(name)
+
+    def apply_optimistic(self, name, **fields):
+        """ Show the expected result of a command before the hub confirms it.
+
+        The values stay in place until async_request_refresh verifies them
+        against the hub, which rolls them back if the hub disagrees.
+        """
+        device = self.devices.get(name)
+        if device is None:
+            return
+        self._expected.setdefault(name, {}).update(fields)
+        self._verify.discard(name)
+        self.devices[name] = device.replace(**fields)
+        self._notify({name})
+
+    async def async_request_refresh(self, names=()):
+        """ Refresh the hub to verify the commands sent to names.
+
+        Requests made while a refresh is pending share that refresh.
+        """
+        self._verify.update(names)
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._async_refresh())
+        await asyncio.shield(self._refresh)
+
+    async def _async_refresh(self):
+        """ Run a requested refresh once every caller of this iteration joined. """
+        await asyncio.sleep(0)
+        self._refresh = None
+        await self.async_update()
+
+    def _apply_expected(self, devices, verified):
+        """ Keep or check optimistic values against freshly polled devices. """
+        for name, fields in list(self._expected.items()):
+            device = devices.get(name)
+            if device is None:
+                del self._expected[name]
+            elif name in verified and name in self._verify:
+                del self._expected[name]
+                self._verify.discard(name)
+                mismatched = {
+                    field: (value, getattr(device, field))
+                    for field, value in fields.items()
+                    if field not in UNVERIFIED_FIELDS
+                    and getattr(device, field) != value
+                }
+                if mismatched:
+                    _LOGGER.warning(
+                        "Neo-hub did not confirm the change to %s, rolling "
+                        "back (expected, actual): %s", name, mismatched)
+            else:
+                # The command is still on its way, keep showing its result.
+                devices[name] = device.replace(**fields)
+
+    def _notify(self, changed, force=False):
+        """ Run the listeners of the changed devices. """
+        for name, update_callback in list(self._listeners):
+            if force or name is None or name in changed:
+                update_callback()
+
+    async def async_update(self, now=None, force=False):
+        """ Poll the hub once and notify the listeners of changed devices.
+
+        With force the hub is queried past its cache and every listener is
+        notified, changed or not.
+        """
+        async with self._poll_lock:
+            started = time.perf_counter()
+            await self._async_poll(force)
+            self.client.stats.poll.record(time.perf_counter() - started)
+
+    async def _async_fetch(self):
+        """ Fetch the hub state, returns the devices and whether every
+        request succeeded.
+
+        Hubs that know GET_LIVE_DATA are polled through it, older hubs
+        through INFO. The devices are None before the hub ever answered.
+        """
+        if self.live_data_supported is not False:
+            live_data = await self.client.async_json_request({"GET_LIVE_DATA": 0})
+            if live_data and "devices" in live_data:
+                self.live_data_supported = True
+                return await self._async_fetch_live(live_data)
+            if self.live_data_supported:
+                return self._live_devices(), False
+        devices, fresh = await self._async_fetch_info()
+        if fresh and self.live_data_supported is None:
+            _LOGGER.info("Neo-hub %s:%s does not support GET_LIVE_DATA, "
+                         "polling INFO", self.host, self.port)
+            self.live_data_supported = False
+        return devices, fresh
+
+    async def _async_fetch_live(self, live_data):
+        """ Complete a GET_LIVE_DATA snapshot with the sections it versions.
+
+        A section is only requested again once its timestamps advanced, so
+        a quiet hub costs a single small request per poll.
+        """
+        self.live_data = live_data
+        if live_data.get(PROFILES_TIMESTAMP) != self._profiles_version:
+            self._profiles_version = live_data.get(PROFILES_TIMESTAMP)
+            self.profiles = {}
+        fresh = True
+        for command, timestamps in LIVE_SECTIONS.items():
+            version = tuple(live_data.get(key) for key in timestamps)
+            if self._section_versions.get(command) == version:
+                continue
+            response = await self.client.async_json_request({command: 0})
+            if valid_section(command, response):
+                self._sections[command] = response
+                self._section_versions[command] = version
+            else:
+                # Asked for again on the next poll, the last snapshot fills
+                # in meanwhile.
+                if response:
+                    _LOGGER.warning("Neo-hub %s:%s sent an unusable %s reply: %s",
+                                    self.host, self.port, command, response)
+                fresh = False
+        return self._live_devices(), fresh
+
+    def _live_devices(self):
+        """ Index the last GET_LIVE_DATA snapshot. """
+        if self.live_data is None:
+            return None
+        return index_live_devices(
+            self.live_data, self._sections.get("GET_ENGINEERS"),
+            self._sections.get("GET_SYSTEM"), self.devices)
+
+    async def _async_fetch_info(self):
+        """ Fetch INFO and ENGINEERS_DATA, for hubs without GET_LIVE_DATA. """
+        info = await self.client.async_json_request({"INFO": 0})
+        if info:
+            self.info = info
+        engineers_data = await self.client.async_json_request({"ENGINEERS_DATA": 0})
+        if engineers_data:
+            self.engineers_data = engineers_data
+        if not self.info:
+            return None, False
+        return (index_devices(self.info, self.engineers_data),
+                bool(info and engineers_data))
+
+    async def _async_poll(self, force):
+        """ Poll the hub, polls never overlap. """
+        verified = set(self._verify)
+        if force:
+            self.client.cache.invalidate()
+            self._section_versions = {}
+        _LOGGER.debug("Polling Neo-hub %s:%s", self.host, self.port)
+        fresh = False
+        changed = set()
+        try:
+            devices, fresh = await self._async_fetch()
+            if devices is not None:
+                # Only a successful poll can confirm or refute a command.
+                self._apply_expected(devices, verified if fresh else ())
+                for name, device in devices.items():
+                    previous = self.devices.get(name)
+                    if previous is None or device.changed(previous, self.deadband):
+                        changed.add(name)
+                        if previous is not None and previous.heating != device.heating:
+                            self.scheduler.activity()
+                    else:
+                        # Keep what was published so drift within the deadband
+                        # is measured against it rather than the last poll.
+                        devices[name] = previous
+                self.devices = devices
+                if changed and self._store is not None:
+                    self._store.async_delay_save(self._snapshot_data, SAVE_DELAY)
+            _LOGGER.debug("Neo-hub %s:%s changed devices: %s",
+                          self.host, self.port, changed)
+        except Exception:
+            fresh = False
+            raise
+        finally:
+            # The next poll is booked whatever happened to this one, a poll
+            # that raised backs off like a hub that did not answer.
+            self._schedule_poll(self.scheduler.next_delay(fresh, changed))
+        _LOGGER.debug("Neo-hub %s:%s cache hits: %s, misses: %s, "
+                      "collapsed reads: %s, latency: %s, traffic: %s",
+                      self.host, self.port, self.client.cache.hits,
+                      self.client.cache.misses, self.client.collapsed,
+                      self.client.latency, self.client.stats)
+
+        # Every entity follows the hub into and out of being unavailable.
+        available = self.available
+        self._notify(changed, force or available != self._published_available)
+        self._published_available = available
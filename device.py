@@ -0,0 +1,198 @@
+"""
+homeassistant.components.climate.heatmiserneo.device
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Parsed Neo-hub state, one compact record per device.
+"""
+
+from homeassistant.const import TEMP_CELSIUS, TEMP_FAHRENHEIT
+
+DEVICE_TYPE_NEOPLUG = 6
+
+# Measured values whose moves within the deadband are not a change.
+DEADBAND_FIELDS = ("current_temperature",)
+
+# Values GET_LIVE_DATA leaves to GET_ENGINEERS.
+ENGINEERS_FIELDS = (
+    "device_type",
+    "frost_temperature",
+    "switching_differential",
+    "output_delay",
+)
+
+
+def _round(value):
+    """ Return value as a float rounded to 2 places, None if not a number. """
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+class NeoDevice:
+    """ Values of one device from a hub snapshot. """
+
+    __slots__ = (
+        "name",
+        "device_type",
+        "timeclock",
+        "temperature_unit",
+        "away",
+        "target_temperature",
+        "current_temperature",
+        "current_humidity",
+        "on_hold",
+        "hold_temperature",
+        "hold_time",
+        "standby",
+        "cooling_enabled",
+        "heating",
+        "cooling",
+        "frost_temperature",
+        "switching_differential",
+        "output_delay",
+        "timer_on",
+        "manual_off",
+    )
+
+    def __init__(self, name):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.name = name
+
+    @classmethod
+    def from_info(cls, device, engineers=None):
+        """ Build a record from an INFO device entry and its ENGINEERS_DATA. """
+        record = cls(device['device'])
+        record.device_type = device.get('DEVICE_TYPE')
+        record.timeclock = 'TIMECLOCK' in (device.get('STAT_MODE') or ())
+        tmptempfmt = device.get('TEMPERATURE_FORMAT')
+        if (tmptempfmt == False) or (str(tmptempfmt).upper() == "C"):
+            record.temperature_unit = TEMP_CELSIUS
+        else:
+            record.temperature_unit = TEMP_FAHRENHEIT
+        record.away = device.get('AWAY')
+        record.target_temperature = _round(device.get('CURRENT_SET_TEMPERATURE'))
+        record.current_temperature = _round(device.get('CURRENT_TEMPERATURE'))
+        record.current_humidity = _round(device.get('HUMIDITY'))
+        record.on_hold = bool(device.get('TEMP_HOLD'))
+        record.hold_temperature = _round(device.get('HOLD_TEMPERATURE'))
+        record.hold_time = device.get('HOLD_TIME')
+        record.standby = bool(device.get('STANDBY'))
+        record.cooling_enabled = device.get('COOLING_ENABLED') == True
+        record.heating = device.get('HEATING') == True
+        record.cooling = device.get('COOLING') == True
+        record.timer_on = device.get('TIMER') == True
+        record.manual_off = device.get('MANUAL_OFF') == True
+        if engineers:
+            record.frost_temperature = _round(engineers.get("FROST TEMPERATURE"))
+            record.switching_differential = _round(engineers.get("SWITCHING DIFFERENTIAL"))
+            record.output_delay = _round(engineers.get("OUTPUT DELAY"))
+        return record
+
+    @classmethod
+    def from_live(cls, device, engineers=None, system=None, previous=None):
+        """ Build a record from a GET_LIVE_DATA device entry, its GET_ENGINEERS
+        entry and the hub's GET_SYSTEM settings.
+
+        Values of a section not read yet are kept from previous, the record
+        of the same device in the last snapshot.
+        """
+        record = cls(device['ZONE_NAME'])
+        record.timeclock = device.get('TIMECLOCK') == True
+        if system is None and previous is not None:
+            record.temperature_unit = previous.temperature_unit
+        elif (system or {}).get('CORF', "C") == "C":
+            record.temperature_unit = TEMP_CELSIUS
+        else:
+            record.temperature_unit = TEMP_FAHRENHEIT
+        record.away = device.get('AWAY')
+        record.target_temperature = _round(device.get('SET_TEMP'))
+        record.current_temperature = _round(device.get('ACTUAL_TEMP'))
+        record.current_humidity = _round(device.get('RELATIVE_HUMIDITY'))
+        record.on_hold = bool(device.get('HOLD_ON'))
+        record.hold_temperature = _round(device.get('HOLD_TEMP'))
+        record.hold_time = device.get('HOLD_TIME')
+        record.standby = bool(device.get('STANDBY'))
+        record.cooling_enabled = device.get('COOL_MODE') == True
+        record.heating = device.get('HEAT_ON') == True
+        record.cooling = device.get('COOL_ON') == True
+        record.timer_on = device.get('TIMER_ON') == True
+        record.manual_off = device.get('MANUAL_OFF') == True
+        if engineers is None and previous is not None:
+            for field in ENGINEERS_FIELDS:
+                setattr(record, field, getattr(previous, field))
+            return record
+        engineers = engineers or {}
+        record.device_type = engineers.get('DEVICE_TYPE')
+        record.frost_temperature = _round(engineers.get("FROST_TEMP"))
+        record.switching_differential = _round(engineers.get(
+            "SWITCHING DIFFERENTIAL", engineers.get("SWITCHING_DIFFERENTIAL")))
+        record.output_delay = _round(engineers.get("OUTPUT_DELAY"))
+        return record
+
+    @classmethod
+    def from_values(cls, fields, values):
+        """ Build a record from values stored by as_values. """
+        record = cls(None)
+        for field, value in zip(fields, values):
+            if field in cls.__slots__:
+                setattr(record, field, value)
+        return record
+
+    def as_values(self):
+        """ Return the values of this record in __slots__ order. """
+        return [getattr(self, field) for field in self.__slots__]
+
+    @property
+    def neoplug(self):
+        """ Return True for a Neoplug. """
+        return self.device_type == DEVICE_TYPE_NEOPLUG
+
+    def replace(self, **fields):
+        """ Return a copy of this record with fields changed. """
+        record = NeoDevice(self.name)
+        for field in self.__slots__:
+            setattr(record, field, fields.get(field, getattr(self, field)))
+        return record
+
+    def changed(self, other, deadband=0):
+        """ Return True if other holds different values than this record. """
+        for field in self.__slots__:
+            mine = getattr(self, field)
+            theirs = getattr(other, field)
+            if mine == theirs:
+                continue
+            if (field in DEADBAND_FIELDS and mine is not None
+                    and theirs is not None and abs(mine - theirs) < deadband):
+                continue
+            return True
+        return False
+
+    def __repr__(self):
+        return "<NeoDevice %s>" % self.name
+
+
+def index_devices(info, engineers_data=None):
+    """ Index the devices of an INFO response by name. """
+    engineers_data = engineers_data or {}
+    return {
+        device['device']: NeoDevice.from_info(
+            device, engineers_data.get(device['device']))
+        for device in info['devices']
+    }
+
+
+def index_live_devices(live_data, engineers=None, system=None, previous=None):
+    """ Index the devices of a GET_LIVE_DATA response by name.
+
+    previous is the last snapshot, it fills in the sections not read yet.
+    """
+    engineers = engineers or {}
+    previous = previous or {}
+    return {
+        device['ZONE_NAME']: NeoDevice.from_live(
+            device, engineers.get(device['ZONE_NAME']), system,
+            previous.get(device['ZONE_NAME']))
+        for device in live_data['devices']
+    }
@@ -0,0 +1,185 @@
+"""
+homeassistant.components.climate.heatmiserneo.history
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Recent readings of a thermostat, and the heating metrics derived from them
+without going back to the recorder.
+"""
+
+import math
+from array import array
+
+# Samples kept per thermostat, only changed readings are stored.
+HISTORY_SIZE = 1440
+
+# Longest duty cycle window, and the shortest seconds between two polls.
+# The heating switches of a whole window always fit in a buffer of
+# DUTY_WINDOW / min_interval entries.
+DUTY_WINDOW = 86400
+MIN_INTERVAL = 10
+
+# Heating must run this many seconds before its rate is trusted.
+MIN_RATE_SPAN = 600
+
+
+def _value(value):
+    """ Return value as a float, NaN for a missing reading. """
+    return math.nan if value is None else float(value)
+
+
+class HeatingSwitches:
+    """ Ring buffer of the times heating switched on or off.
+
+    Each entry also holds the heating seconds accumulated up to it, so the
+    duty cycle over any window only needs a binary search for the start
+    of the window. The arrays grow as switches come, up to size.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._times = array("d")
+        self._heated = array("d")
+        self._heating = array("b")
+        self._start = 0
+
+    def __len__(self):
+        return len(self._times)
+
+    def _index(self, position):
+        """ Return the array index of the switch at position, oldest first. """
+        return (self._start + position) % len(self._times)
+
+    def append(self, timestamp, heating):
+        """ Record the heating state at timestamp, if it switched. """
+        heating = 1 if heating else 0
+        heated = 0.0
+        if self._times:
+            last = self._index(len(self._times) - 1)
+            if self._heating[last] == heating:
+                return
+            heated = self._heated[last] + (timestamp - self._times[last]) * self._heating[last]
+        if len(self._times) < self._size:
+            self._times.append(timestamp)
+            self._heated.append(heated)
+            self._heating.append(heating)
+            return
+        slot = self._start
+        self._start = (self._start + 1) % self._size
+        self._times[slot] = timestamp
+        self._heated[slot] = heated
+        self._heating[slot] = heating
+
+    def duty_cycle(self, window, now):
+        """ Return the share of the last window seconds spent heating, in percent.
+
+        None until the switches kept reach back to the start of the window.
+        """
+        if not self._times:
+            return None
+        start_time = now - window
+        if start_time < self._times[self._index(0)]:
+            return None
+        last = self._index(len(self._times) - 1)
+        end_heated = self._heated[last] + (now - self._times[last]) * self._heating[last]
+        # Last switch at or before the start of the window.
+        low, high = 0, len(self._times) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._times[self._index(middle)] <= start_time:
+                low = middle
+            else:
+                high = middle - 1
+        index = self._index(low)
+        start_heated = (self._heated[index]
+                        + (start_time - self._times[index]) * self._heating[index])
+        return round(100 * (end_heated - start_heated) / window, 1)
+
+
+class ZoneHistory:
+    """ Fixed size ring buffer of (time, current, target, heating) samples.
+
+    The samples live in preallocated arrays and feed the heat rate. The
+    duty cycle comes from the heating switches, kept apart so a zone whose
+    temperature keeps moving still covers a whole DUTY_WINDOW.
+    """
+
+    def __init__(self, size=HISTORY_SIZE, min_interval=MIN_INTERVAL):
+        self._size = size
+        self._times = array("d", bytes(8 * size))
+        self._current = array("d", bytes(8 * size))
+        self._target = array("d", bytes(8 * size))
+        self._heating = array("b", bytes(size))
+        self._start = 0
+        self._count = 0
+        self._switches = HeatingSwitches(int(DUTY_WINDOW // min_interval) + 1)
+        # Start (time, temperature) of the current heating run, and the
+        # rate of the current or last run in degrees per hour.
+        self._run_start = None
+        self.heat_rate = None
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, position):
+        """ Return the array index of the sample at position, oldest first. """
+        return (self._start + position) % self._size
+
+    def append(self, timestamp, current, target, heating):
+        """ Add a reading, readings equal to the last one are skipped. """
+        current = _value(current)
+        target = _value(target)
+        heating = 1 if heating else 0
+        self._switches.append(timestamp, heating)
+        was_heating = 0
+        if self._count:
+            last = self._index(self._count - 1)
+            if (self._heating[last] == heating
+                    and _same(self._current[last], current)
+                    and _same(self._target[last], target)):
+                return
+            was_heating = self._heating[last]
+
+        if self._count == self._size:
+            slot = self._start
+            self._start = (self._start + 1) % self._size
+        else:
+            slot = self._index(self._count)
+            self._count += 1
+        self._times[slot] = timestamp
+        self._current[slot] = current
+        self._target[slot] = target
+        self._heating[slot] = heating
+
+        if was_heating and self._run_start is not None:
+            started, temperature = self._run_start
+            if timestamp - started >= MIN_RATE_SPAN and not math.isnan(current):
+                self.heat_rate = round(
+                    (current - temperature) * 3600 / (timestamp - started), 2)
+        if heating and not was_heating:
+            self._run_start = (timestamp, current) if not math.isnan(current) else None
+        elif not heating:
+            self._run_start = None
+
+    def duty_cycle(self, window, now):
+        """ Return the share of the last window seconds spent heating, in percent.
+
+        None until the history reaches back to the start of the window.
+        """
+        return self._switches.duty_cycle(window, now)
+
+    def time_to_target(self):
+        """ Return the minutes left until a heating zone reaches its target. """
+        if not self._count or not self.heat_rate or self.heat_rate <= 0:
+            return None
+        last = self._index(self._count - 1)
+        current = self._current[last]
+        target = self._target[last]
+        if (not self._heating[last] or math.isnan(current)
+                or math.isnan(target) or current >= target):
+            return None
+        return round((target - current) * 60 / self.heat_rate)
+
+
+def _same(first, second):
+    """ Return True if two readings are equal, NaN equals NaN. """
+    return first == second or (math.isnan(first) and math.isnan(second))
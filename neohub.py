@@ -0,0 +1,671 @@
+"""
+homeassistant.components.climate.heatmiserneo.neohub
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Low level access to the Heatmiser Neo-hub JSON protocol.
+"""
+
+import asyncio
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import logging
+import random
+import socket
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 5
+
+# Seconds an unused connection is kept open before it is closed.
+IDLE_TIMEOUT = 60
+
+# The hub serves one request at a time, extra sockets only queue on it.
+MAX_CONNECTIONS = 1
+
+# Commands from users go to the hub ahead of queued background reads.
+PRIORITY_COMMAND = 0
+PRIORITY_READ = 1
+PRIORITY_NAMES = {PRIORITY_COMMAND: "command", PRIORITY_READ: "read"}
+
+# Requests of one priority allowed to wait for the hub, more are refused.
+MAX_QUEUE = 20
+
+# Recent frames kept per hub for dump_trace, the share of frames traced,
+# and how much of a frame a debug log line shows.
+TRACE_SIZE = 50
+TRACE_SAMPLE_RATE = 1.0
+TRACE_LOG_LIMIT = 500
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Largest response frame accepted from the hub.
+READ_LIMIT = 2 ** 20
+
+TERMINATOR = b"\0"
+
+# Spare room handed to the transport for every socket read.
+READ_CHUNK = 4096
+
+# Seconds the response of each read command is reused. INFO and
+# GET_LIVE_DATA carry the live zone values, ENGINEERS_DATA only changes when
+# a stat is reconfigured. GET_ENGINEERS and GET_SYSTEM are never cached,
+# they are only sent once their GET_LIVE_DATA timestamp has advanced, the
+# zone logs are cached per period by ZoneLogs and the comfort level
+# profiles per zone by the coordinator.
+CACHE_TTLS = {
+    "INFO": 5,
+    "GET_LIVE_DATA": 5,
+    "ENGINEERS_DATA": 3600,
+    "GET_ENGINEERS": 0,
+    "GET_SYSTEM": 0,
+    "GET_TEMPLOG": 0,
+    "GET_HOURSRUN": 0,
+    "READ_COMFORT_LEVELS": 0,
+}
+
+# Read commands whose cached response a command makes stale, other
+# commands only invalidate the live zone values.
+LIVE_READS = ("INFO", "GET_LIVE_DATA")
+INVALIDATES = {
+    "SET_FROST": LIVE_READS + ("ENGINEERS_DATA",),
+}
+
+# Consecutive failures that open the circuit to a hub, and seconds it
+# stays open before a single probe request is let through.
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 30
+
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+)
+
+# Errors showing a kept-alive socket was dead before the hub handled the
+# request, only those are retried on a new socket. A timeout never is, the
+# hub may have acted on the request.
+STALE_CONNECTION_ERRORS = (
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+def request_command(request):
+    """ Return the command name of a single command request. """
+    if isinstance(request, dict) and len(request) == 1:
+        return next(iter(request))
+    return None
+
+
+class _FrameText:
+    """ Decodes and shortens a frame only if a log line is emitted. """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __str__(self):
+        text = bytes(self._data[:TRACE_LOG_LIMIT]).decode("utf-8", "replace")
+        if len(self._data) > TRACE_LOG_LIMIT:
+            text += "... (%d bytes)" % len(self._data)
+        return text.strip("\0\r\n")
+
+
+class HubTracer:
+    """ Keeps a sample of the raw frames exchanged with a hub.
+
+    Frames are stored as received, nothing is decoded or formatted unless
+    debug logging is on or the buffer is dumped.
+    """
+
+    def __init__(self, name, size=TRACE_SIZE, sample_rate=TRACE_SAMPLE_RATE):
+        self._name = name
+        self.sample_rate = sample_rate
+        self.frames = collections.deque(maxlen=size)
+
+    def record(self, direction, data):
+        """ Trace a frame sent (">") or received ("<"), if sampled. """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        self.frames.append((time.time(), direction, bytes(data)))
+        _LOGGER.debug("Neo-hub %s %s %s", self._name, direction, _FrameText(data))
+
+    def dump(self):
+        """ Return the traced frames, oldest first, with decoded text. """
+        return [
+            {
+                "time": timestamp,
+                "direction": direction,
+                "frame": data.decode("utf-8", "replace").strip("\0\r\n"),
+            }
+            for timestamp, direction, data in self.frames
+        ]
+
+
+class LatencyStats:
+    """ Count, mean, worst and histogram of a series of durations. """
+
+    __slots__ = ("count", "total", "max", "last", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        # One count per LATENCY_BUCKETS bound, plus one for longer ones.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds):
+        """ Add a duration. """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @property
+    def mean(self):
+        """ Return the mean duration, 0 before the first one. """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        """ Return the bucket bound below which fraction of durations fall. """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return bound
+        return self.max
+
+    def __repr__(self):
+        return "<%d requests, mean %.3fs, max %.3fs>" % (
+            self.count, self.mean, self.max)
+
+
+class PriorityGate:
+    """ Hands the sockets of a hub to waiting requests, by priority.
+
+    Lower priorities are served first, requests of equal priority in the
+    order they arrived.
+    """
+
+    def __init__(self, slots, max_queue=MAX_QUEUE):
+        self._free = slots
+        self._max_queue = max_queue
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.queued = {}
+
+    async def acquire(self, priority):
+        """ Wait for a socket, returns False if the queue is full. """
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return True
+        if self.queued.get(priority, 0) >= self._max_queue:
+            return False
+        waiter = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self.queued[priority] = self.queued.get(priority, 0) + 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The socket was handed over just before the cancel.
+                self.release()
+            raise
+        finally:
+            self.queued[priority] -= 1
+        return True
+
+    def release(self):
+        """ Hand a socket back, to the most urgent waiter if any. """
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)[2]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+
+class CircuitBreaker:
+    """ Tracks the health of a hub and fails requests fast while it is down.
+
+    After FAILURE_THRESHOLD consecutive failures the circuit opens and
+    requests fail without touching the network. Once RESET_TIMEOUT has
+    passed it is half open: one probe request goes through, its success
+    closes the circuit and its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT):
+        self._name = name
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._probing = False
+
+    @property
+    def available(self):
+        """ Return False while the circuit is open. """
+        return self.state != self.OPEN
+
+    def allow(self, now):
+        """ Return True if a request may be sent now. """
+        if self.state == self.OPEN:
+            if now - self._opened_at < self._reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        """ Close the circuit after a successful request. """
+        if self.state != self.CLOSED:
+            _LOGGER.info("Neo-hub %s is reachable again", self._name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, now):
+        """ Count a failed request, opening the circuit when due. """
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self._threshold:
+            if self.state == self.CLOSED:
+                _LOGGER.warning("Neo-hub %s is unreachable, failing requests "
+                                "for %ss", self._name, self._reset_timeout)
+            self.state = self.OPEN
+            self._opened_at = now
+
+
+class HubStats:
+    """ Traffic and timing counters of one hub. """
+
+    def __init__(self):
+        self.commands = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections_opened = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.decode = LatencyStats()
+        self.poll = LatencyStats()
+
+    def command(self, command):
+        """ Return the round trip latency of a hub command. """
+        if command not in self.commands:
+            self.commands[command] = LatencyStats()
+        return self.commands[command]
+
+    @property
+    def requests(self):
+        """ Return the round trips made to the hub. """
+        return sum(stats.count for stats in self.commands.values())
+
+    def __repr__(self):
+        return ("<%d requests, %d bytes in, %d bytes out, %d connections, "
+                "%d timeouts, %d errors>" % (
+                    self.requests, self.bytes_in, self.bytes_out,
+                    self.connections_opened, self.timeouts, self.errors))
+
+
+class NeoHubCache:
+    """ Responses of read commands, each kept for its own time to live. """
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.hits = {}
+        self.misses = {}
+        self._entries = {}
+
+    def is_read(self, command):
+        """ Return True for a read command, whose response may be cached. """
+        return command in self.ttls
+
+    def get(self, command, now):
+        """ Return the cached response of command, None when stale. """
+        entry = self._entries.get(command)
+        if entry is not None and now < entry[0]:
+            self.hits[command] = self.hits.get(command, 0) + 1
+            return entry[1]
+        self.misses[command] = self.misses.get(command, 0) + 1
+        return None
+
+    def set(self, command, response, now):
+        """ Store the response of command. """
+        if self.ttls[command] > 0:
+            self._entries[command] = (now + self.ttls[command], response)
+
+    def invalidate(self, *commands):
+        """ Drop the cached responses of commands, of all with none. """
+        if not commands:
+            self._entries.clear()
+        for command in commands:
+            self._entries.pop(command, None)
+
+    def command_sent(self, command):
+        """ Drop the responses made stale by sending command. """
+        self.invalidate(*INVALIDATES.get(command, LIVE_READS))
+
+
+class NeoHubFrameParser:
+    """ Splits the hub byte stream into null terminated frames.
+
+    Socket reads land directly in a preallocated buffer, only the newly
+    received bytes are scanned for the terminator and each complete frame
+    is copied out exactly once.
+    """
+
+    def __init__(self, limit=READ_LIMIT):
+        self._limit = limit
+        self._buffer = bytearray(READ_CHUNK)
+        # Bytes received, bytes consumed by returned frames.
+        self._end = 0
+        self._start = 0
+
+    def get_buffer(self):
+        """ Return a writable view of the free space of the buffer. """
+        pending = self._end - self._start
+        if self._start and (not pending or len(self._buffer) - self._end < READ_CHUNK):
+            # Move the unterminated tail to the front, skipped when empty.
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        if len(self._buffer) - self._end < READ_CHUNK:
+            buffer = bytearray(max(len(self._buffer) * 2, self._end + READ_CHUNK))
+            buffer[:self._end] = self._buffer[:self._end]
+            self._buffer = buffer
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """ Account for nbytes written into the last buffer, return frames. """
+        scan = self._end
+        self._end += nbytes
+        frames = []
+        with memoryview(self._buffer) as view:
+            while True:
+                index = self._buffer.find(TERMINATOR, scan, self._end)
+                if index < 0:
+                    break
+                frames.append(bytes(view[self._start:index]))
+                self._start = scan = index + len(TERMINATOR)
+        if self._end - self._start > self._limit:
+            raise ValueError("Neo-hub frame larger than %d bytes" % self._limit)
+        return frames
+
+
+class NeoHubProtocol(asyncio.BufferedProtocol):
+    """ Request/response protocol for one socket to the hub. """
+
+    def __init__(self):
+        self._parser = NeoHubFrameParser()
+        self._transport = None
+        self._waiter = None
+        self.closed = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def get_buffer(self, sizehint):
+        return self._parser.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            frames = self._parser.buffer_updated(nbytes)
+        except ValueError as err:
+            self._fail(ConnectionError(str(err)))
+            self._transport.close()
+            return
+        for frame in frames:
+            if self._waiter is not None and not self._waiter.done():
+                self._waiter.set_result(frame)
+            else:
+                _LOGGER.debug("Dropping unsolicited Neo-hub frame")
+
+    def eof_received(self):
+        self._fail(ConnectionResetError("Neo-hub closed the connection"))
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._fail(exc or ConnectionResetError("Neo-hub connection lost"))
+
+    def _fail(self, exc):
+        """ Wake a pending request with exc. """
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(exc)
+
+    async def async_request(self, data, timeout):
+        """ Write a request and wait for its response frame. """
+        self._waiter = asyncio.get_event_loop().create_future()
+        try:
+            self._transport.write(data)
+            return await asyncio.wait_for(self._waiter, timeout)
+        finally:
+            self._waiter = None
+
+
+class NeoHubConnection:
+    """ A single socket to the hub, carrying one request at a time. """
+
+    def __init__(self, host, port, timeout, stats):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._stats = stats
+        self._transport = None
+        self._protocol = None
+        self.last_used = 0
+
+    @property
+    def connected(self):
+        """ Return True if the socket is open and not closed by the hub. """
+        return self._protocol is not None and not self._protocol.closed
+
+    async def async_connect(self):
+        """ Open the socket. """
+        loop = asyncio.get_event_loop()
+        self._transport, self._protocol = await asyncio.wait_for(
+            loop.create_connection(NeoHubProtocol, self._host, self._port),
+            self._timeout)
+        self._stats.connections_opened += 1
+        sock = self._transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    async def async_request(self, data):
+        """ Send an encoded request and return the response frame. """
+        if not self.connected:
+            self.close()
+            await self.async_connect()
+        self._stats.bytes_out += len(data)
+        frame = await self._protocol.async_request(data, self._timeout)
+        self._stats.bytes_in += len(frame) + len(TERMINATOR)
+        self.last_used = asyncio.get_event_loop().time()
+        return frame
+
+    def close(self):
+        """ Close the socket. """
+        if self._transport is not None:
+            self._transport.close()
+        self._transport = None
+        self._protocol = None
+
+
+class NeoHubClient:
+    """ Long-lived, serialized access to one Neo-hub. """
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT,
+                 idle_timeout=IDLE_TIMEOUT, max_connections=MAX_CONNECTIONS,
+                 trace_sample_rate=TRACE_SAMPLE_RATE):
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        # Requests queue on this until one of the sockets is free.
+        self._gate = PriorityGate(max_connections)
+        self.latency = {
+            name: LatencyStats() for name in PRIORITY_NAMES.values()}
+        self._idle = []
+        self._idle_handle = None
+        self.cache = NeoHubCache()
+        self.health = CircuitBreaker("%s:%s" % (host, port))
+        self.stats = HubStats()
+        self.tracer = HubTracer(
+            "%s:%s" % (host, port), sample_rate=trace_sample_rate)
+        # Identical reads in flight, and how many callers joined one.
+        self._in_flight = {}
+        self.collapsed = {}
+
+    async def async_json_request(self, request=None):
+        """ Communicate with the json server, reads may come from cache. """
+        command = request_command(request)
+        if command is None:
+            return await self._async_json_request(request)
+
+        loop = asyncio.get_event_loop()
+        if not self.cache.is_read(command):
+            self.cache.command_sent(command)
+            response = await self._async_json_request(
+                request, PRIORITY_COMMAND)
+            # Invalidate again, a poll may have cached the old state meanwhile.
+            self.cache.command_sent(command)
+            return response
+
+        response = self.cache.get(command, loop.time())
+        if response is None:
+            response = await self._async_single_flight(command, request)
+        return response
+
+    async def _async_single_flight(self, command, request):
+        """ Read from the hub, sharing the round trip of an identical read. """
+        key = json.dumps(request, sort_keys=True)
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.collapsed[command] = self.collapsed.get(command, 0) + 1
+        else:
+            pending = self._in_flight[key] = asyncio.ensure_future(
+                self._async_read(command, request))
+            pending.add_done_callback(
+                lambda task: self._in_flight.pop(key, None))
+        # One caller giving up must not cancel the read for the others.
+        return await asyncio.shield(pending)
+
+    async def _async_read(self, command, request):
+        """ Read from the hub and cache the response. """
+        response = await self._async_json_request(request)
+        if response:
+            self.cache.set(command, response, asyncio.get_event_loop().time())
+        return response
+
+    async def _async_json_request(self, request, priority=PRIORITY_READ):
+        """ Communicate with the json server over a kept-alive socket. """
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        if not await self._gate.acquire(priority):
+            _LOGGER.warning("Neo-hub %s:%s has too many %s requests queued, "
+                            "dropping %s", self.host, self.port,
+                            PRIORITY_NAMES[priority], request)
+            return False
+        try:
+            if not self.health.allow(loop.time()):
+                return False
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connection = NeoHubConnection(
+                    self.host, self.port, self._timeout, self.stats)
+            completed = False
+            try:
+                if not request:
+                    # no communication needed, simple presence detection
+                    if not connection.connected:
+                        await connection.async_connect()
+                    completed = True
+                    return True
+
+                sent = loop.time()
+                data = bytearray(json.dumps(request) + "\0\r", "utf-8")
+                self.tracer.record(">", data)
+                reused = connection.connected
+                try:
+                    frame = await connection.async_request(data)
+                except STALE_CONNECTION_ERRORS:
+                    if not reused:
+                        raise
+                    # The hub dropped the kept-alive socket, reconnect once.
+                    connection.close()
+                    frame = await connection.async_request(data)
+                self.tracer.record("<", frame)
+                self.stats.command(request_command(request)).record(
+                    loop.time() - sent)
+
+                # Decoded once, straight from the frame bytes.
+                decode_started = time.perf_counter()
+                response = json.loads(frame, strict=False)
+                self.stats.decode.record(time.perf_counter() - decode_started)
+                completed = True
+            except CONNECTION_ERRORS + (ValueError,) as err:
+                # something is wrong, assume it's offline, a garbled
+                # response leaves the socket in an unknown state too
+                if isinstance(err, asyncio.TimeoutError):
+                    self.stats.timeouts += 1
+                else:
+                    self.stats.errors += 1
+                _LOGGER.debug("Neo-hub %s:%s request failed: %r",
+                              self.host, self.port, err)
+                return False
+            finally:
+                if completed:
+                    self.health.record_success()
+                    self._idle.append(connection)
+                    self._schedule_idle_check()
+                else:
+                    self.health.record_failure(loop.time())
+                    connection.close()
+        finally:
+            self._gate.release()
+            self.latency[PRIORITY_NAMES[priority]].record(
+                loop.time() - started)
+
+        return response
+
+    def _schedule_idle_check(self):
+        """ Arrange for sockets left unused too long to be closed. """
+        if self._idle_handle is None:
+            self._idle_handle = asyncio.get_event_loop().call_later(
+                self._idle_timeout, self._close_idle)
+
+    def _close_idle(self):
+        """ Close sockets unused for longer than the idle timeout. """
+        self._idle_handle = None
+        deadline = asyncio.get_event_loop().time() - self._idle_timeout
+        for connection in list(self._idle):
+            if connection.last_used <= deadline:
+                self._idle.remove(connection)
+                connection.close()
+        if self._idle:
+            self._schedule_idle_check()
+
+    def close(self):
+        """ Close every socket to the hub. """
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        while self._idle:
+            self._idle.pop().close()
@@ -0,0 +1,221 @@
+"""
+homeassistant.components.sensor.heatmiserneo
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Diagnostic sensors of Heatmiser Neo-hub performance, and the hours run
+of each thermostat, set up by the climate platform for each hub it polls.
+"""
+
+import logging
+from datetime import timedelta
+
+from homeassistant.const import CONF_HOST, CONF_PORT
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity
+
+from .coordinator import DATA_COORDINATORS
+from .zonelog import HOURS_RUN
+
+_LOGGER = logging.getLogger(__name__)
+
+# Hours run sensors refresh this often, matching how long ZoneLogs reuses
+# a zone's log.
+SCAN_INTERVAL = timedelta(minutes=30)
+
+
+def _ms(seconds):
+    """ Return seconds as rounded milliseconds. """
+    return round(seconds * 1000, 1)
+
+
+def _latency_attributes(stats):
+    """ Return the attributes describing a LatencyStats. """
+    return {
+        "count": stats.count,
+        "mean_ms": _ms(stats.mean),
+        "p95_ms": _ms(stats.percentile(0.95)),
+        "max_ms": _ms(stats.max),
+    }
+
+
+def _request_latency(client):
+    """ Return the mean round trip of every hub command. """
+    stats = client.stats
+    count = stats.requests
+    if not count:
+        return 0.0
+    return _ms(sum(command.total for command in stats.commands.values()) / count)
+
+
+def _request_latency_attributes(client):
+    """ Return the latency of each hub command. """
+    return {
+        command: _latency_attributes(stats)
+        for command, stats in client.stats.commands.items()
+    }
+
+
+def _cache_hit_ratio(client):
+    """ Return the share of reads served from cache, in percent. """
+    hits = sum(client.cache.hits.values())
+    total = hits + sum(client.cache.misses.values())
+    return round(100 * hits / total, 1) if total else 0.0
+
+
+# Key, name, unit, icon, value and attributes of each sensor.
+SENSORS = (
+    ("poll_duration", "Poll Duration", "ms", "mdi:timer-outline",
+     lambda client: _ms(client.stats.poll.last),
+     lambda client: _latency_attributes(client.stats.poll)),
+    ("request_latency", "Request Latency", "ms", "mdi:timer-sand",
+     _request_latency, _request_latency_attributes),
+    ("decode_time", "Decode Time", "ms", "mdi:code-json",
+     lambda client: _ms(client.stats.decode.last),
+     lambda client: _latency_attributes(client.stats.decode)),
+    ("bytes_in", "Bytes Received", "B", "mdi:download-network",
+     lambda client: client.stats.bytes_in, None),
+    ("bytes_out", "Bytes Sent", "B", "mdi:upload-network",
+     lambda client: client.stats.bytes_out, None),
+    ("connections_opened", "Connections Opened", None, "mdi:lan-connect",
+     lambda client: client.stats.connections_opened, None),
+    ("timeouts", "Request Timeouts", None, "mdi:timer-alert-outline",
+     lambda client: client.stats.timeouts, None),
+    ("errors", "Request Errors", None, "mdi:alert-circle-outline",
+     lambda client: client.stats.errors, None),
+    ("cache_hit_ratio", "Cache Hit Ratio", "%", "mdi:cached",
+     _cache_hit_ratio, None),
+)
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """ Sets up the diagnostic and hours run sensors of a Neo-hub. """
+    if discovery_info is None:
+        return
+    host = discovery_info[CONF_HOST]
+    port = discovery_info[CONF_PORT]
+    coordinator = hass.data[DATA_COORDINATORS][(host, port)]
+    async_add_entities([
+        HeatmiserNeoHubSensor(coordinator, *sensor) for sensor in SENSORS
+    ])
+    known_devices = set()
+
+    @callback
+    def async_add_new_devices():
+        """Add the hours run sensors of thermostats not seen before."""
+        sensors = []
+        for device in coordinator.devices.values():
+            if (device.name in known_devices or device.neoplug
+                    or device.timeclock):
+                continue
+            known_devices.add(device.name)
+            sensors.append(HeatmiserNeoHoursRunSensor(coordinator, device.name))
+        if sensors:
+            async_add_entities(sensors, True)
+
+    async_add_new_devices()
+    coordinator.add_listener(async_add_new_devices)
+
+
+class HeatmiserNeoHubSensor(Entity):
+    """ Represents one performance figure of a Neo-hub. """
+
+    def __init__(self, coordinator, key, name, unit, icon, value, attributes):
+        self._coordinator = coordinator
+        self._key = key
+        self._name = "Neo-hub %s %s" % (coordinator.host, name)
+        self._unit = unit
+        self._icon = icon
+        self._value = value
+        self._attributes = attributes
+        self._remove_listener = None
+
+    @property
+    def should_poll(self):
+        """ No polling needed, refreshed after every hub poll. """
+        return False
+
+    @property
+    def name(self):
+        """ Returns the name. """
+        return self._name
+
+    @property
+    def icon(self):
+        """ Return the icon. """
+        return self._icon
+
+    @property
+    def unit_of_measurement(self):
+        """ Return the unit of measurement. """
+        return self._unit
+
+    @property
+    def state(self):
+        """ Return the current value. """
+        return self._value(self._coordinator.client)
+
+    @property
+    def device_state_attributes(self):
+        """ Return the state attributes. """
+        if self._attributes is None:
+            return None
+        return self._attributes(self._coordinator.client)
+
+    async def async_added_to_hass(self):
+        """ Subscribe to hub polls. """
+        self._remove_listener = self._coordinator.add_listener(
+            self._handle_coordinator_update)
+
+    async def async_will_remove_from_hass(self):
+        """ Unsubscribe from hub polls. """
+        if self._remove_listener:
+            self._remove_listener()
+            self._remove_listener = None
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Publish the figures of the last poll. """
+        self.async_schedule_update_ha_state()
+
+
+class HeatmiserNeoHoursRunSensor(Entity):
+    """ Represents the heating hours run by a thermostat, read from the hub. """
+
+    def __init__(self, coordinator, name):
+        self._coordinator = coordinator
+        self._zone = name
+        self._name = "%s Hours Run" % name
+        self._periods = {}
+
+    @property
+    def name(self):
+        """ Returns the name. """
+        return self._name
+
+    @property
+    def icon(self):
+        """ Return the icon. """
+        return "mdi:clock-outline"
+
+    @property
+    def unit_of_measurement(self):
+        """ Return the unit of measurement. """
+        return "h"
+
+    @property
+    def state(self):
+        """ Return the hours run of the latest period. """
+        if not self._periods:
+            return None
+        latest = self._periods[max(self._periods)]
+        return latest if isinstance(latest, (int, float)) else None
+
+    @property
+    def device_state_attributes(self):
+        """ Return the hours run of every cached period. """
+        return {"periods": self._periods}
+
+    async def async_update(self):
+        """ Read new periods from the hub once the cached log has expired. """
+        logs = await self._coordinator.logs.async_get(HOURS_RUN, [self._zone])
+        self._periods = logs[self._zone]
@@ -0,0 +1,156 @@
+"""
+homeassistant.components.switch.heatmiserneo
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Neoplugs and Neostats in timeclock mode, set up by the climate platform
+for each hub it polls and fed from the same hub snapshot.
+"""
+
+import logging
+
+from homeassistant.components.switch import SwitchDevice
+from homeassistant.const import CONF_HOST, CONF_PORT
+from homeassistant.core import callback
+
+from .coordinator import DATA_COORDINATORS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """ Sets up the Neoplugs and timeclocks of a Neo-hub. """
+    if discovery_info is None:
+        return
+    host = discovery_info[CONF_HOST]
+    port = discovery_info[CONF_PORT]
+    coordinator = hass.data[DATA_COORDINATORS][(host, port)]
+    known_devices = set()
+
+    @callback
+    def async_add_new_devices():
+        """Add the switches of devices not seen before."""
+        switches = []
+        for device in coordinator.devices.values():
+            if device.name in known_devices:
+                continue
+            if device.neoplug:
+                switches.append(HeatmiserNeoplug(coordinator, device.name))
+            elif device.timeclock:
+                switches.append(HeatmiserNeoTimeclock(coordinator, device.name))
+            else:
+                continue
+            known_devices.add(device.name)
+
+        if switches:
+            _LOGGER.info("Adding Switches: %s ", switches)
+            async_add_entities(switches)
+
+    async_add_new_devices()
+    coordinator.add_listener(async_add_new_devices)
+
+
+class HeatmiserNeoSwitch(SwitchDevice):
+    """ Represents the timer output of a Neo-hub device. """
+
+    def __init__(self, coordinator, name):
+        self._coordinator = coordinator
+        self._name = name
+        self._remove_listener = None
+
+    @property
+    def should_poll(self):
+        """ No polling needed, the hub coordinator pushes updates. """
+        return False
+
+    @property
+    def available(self):
+        """ Return False while the hub is unreachable. """
+        return self._coordinator.available
+
+    @property
+    def coordinator(self):
+        """ Return the coordinator polling this device's hub. """
+        return self._coordinator
+
+    @property
+    def name(self):
+        """ Returns the name. """
+        return self._name
+
+    @property
+    def is_on(self):
+        """ Return True if the output is on. """
+        device = self._coordinator.device(self._name)
+        return device is not None and device.timer_on
+
+    async def async_turn_on(self, **kwargs):
+        """ Switch the output on. """
+        await self._async_switch("TIMER_ON", True)
+
+    async def async_turn_off(self, **kwargs):
+        """ Switch the output off. """
+        await self._async_switch("TIMER_OFF", False)
+
+    async def _async_switch(self, command, timer_on):
+        """ Send a timer command and show its result until the hub confirms it. """
+        response = await self._coordinator.async_batched_command(
+            command, None, self._name)
+        _LOGGER.info("%s response: %s ", command, response)
+        if response and "result" in response:
+            self._coordinator.apply_optimistic(self._name, timer_on=timer_on)
+        await self._coordinator.async_request_refresh([self._name])
+
+    async def async_added_to_hass(self):
+        """ Subscribe to hub snapshots. """
+        self._remove_listener = self._coordinator.add_listener(
+            self._handle_coordinator_update, self._name)
+
+    async def async_will_remove_from_hass(self):
+        """ Unsubscribe from hub snapshots. """
+        if self._remove_listener:
+            self._remove_listener()
+            self._remove_listener = None
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Publish the new hub snapshot. """
+        self.async_schedule_update_ha_state()
+
+
+class HeatmiserNeoplug(HeatmiserNeoSwitch):
+    """ Represents a Heatmiser Neoplug. """
+
+    @property
+    def icon(self):
+        """ Return the icon. """
+        return "mdi:power-socket-uk"
+
+    @property
+    def device_state_attributes(self):
+        """ Return the state attributes. """
+        device = self._coordinator.device(self._name)
+        if device is None:
+            return None
+        return {"manual_off": device.manual_off}
+
+
+class HeatmiserNeoTimeclock(HeatmiserNeoSwitch):
+    """ Represents a Heatmiser Neostat configured as a timeclock. """
+
+    @property
+    def icon(self):
+        """ Return the icon. """
+        return "mdi:timer-outline"
+
+    @property
+    def device_state_attributes(self):
+        """ Return the state attributes. """
+        device = self._coordinator.device(self._name)
+        if device is None:
+            return None
+        return {
+            "on_hold": device.on_hold,
+            "hold_time": device.hold_time,
+            "away": device.away,
+            "on_standby": device.standby,
+        }
@@ -0,0 +1,62 @@
+"""
+Test setup: the repository is imported as the heatmiserneo package, the
+same way bench/benchmark.py loads it, and the simulator is importable.
+
+The hub modules only import a few names from Home Assistant. When it is
+not installed those are provided here, so every test still runs.
+"""
+
+import asyncio
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+
+def _install_homeassistant_stand_ins():
+    """ Register minimal homeassistant modules for the hub modules. """
+    const = types.ModuleType("homeassistant.const")
+    const.EVENT_HOMEASSISTANT_STOP = "homeassistant_stop"
+    const.TEMP_CELSIUS = "°C"
+    const.TEMP_FAHRENHEIT = "°F"
+
+    core = types.ModuleType("homeassistant.core")
+    core.callback = lambda func: func
+
+    event = types.ModuleType("homeassistant.helpers.event")
+
+    def async_call_later(hass, delay, action):
+        handle = asyncio.get_event_loop().call_later(
+            delay, lambda: asyncio.ensure_future(action(None)))
+        return handle.cancel
+
+    event.async_call_later = async_call_later
+
+    helpers = types.ModuleType("homeassistant.helpers")
+    helpers.event = event
+    package = types.ModuleType("homeassistant")
+    package.const = const
+    package.core = core
+    package.helpers = helpers
+    for module in (package, const, core, helpers, event):
+        sys.modules[module.__name__] = module
+
+
+try:
+    import homeassistant.helpers.event  # noqa: F401
+except ImportError:
+    _install_homeassistant_stand_ins()
+
+from benchmark import load_component  # noqa: E402
+
+load_component()
+
+
+@pytest.fixture
+def run():
+    """ Run a coroutine to completion on a fresh event loop. """
+    return asyncio.run
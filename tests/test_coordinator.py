@@ -0,0 +1,276 @@
+"""
+Tests of the coordinator against the simulator: polling, the adaptive
+schedule, batching, optimistic values and availability.
+"""
+
+import asyncio
+
+import pytest
+
+from heatmiserneo import coordinator as coordinator_module
+from heatmiserneo.coordinator import (
+    FAST_INTERVAL, NeoHubCoordinator, PollScheduler)
+from heatmiserneo.neohub import NeoHubClient
+from neohub_simulator import NeoHubSimulator
+
+
+async def start(zones=3, **options):
+    """ Start a simulator and a coordinator polling it. """
+    simulator = NeoHubSimulator(zones=zones, seed=1, **options)
+    await simulator.start()
+    coordinator = NeoHubCoordinator(NeoHubClient("127.0.0.1", simulator.port))
+    await coordinator.async_update()
+    return simulator, coordinator
+
+
+async def stop(simulator, coordinator):
+    coordinator.client.close()
+    await simulator.stop()
+
+
+def test_scheduler_backs_off_and_speeds_up():
+    scheduler = PollScheduler(60)
+    assert scheduler.next_delay(False, set(), now=0) == 120
+    assert scheduler.next_delay(False, set(), now=0) == 240
+    assert scheduler.next_delay(True, set(), now=0) == 90
+    assert scheduler.next_delay(True, {"Zone 1"}, now=0) == 60
+    scheduler.activity()
+    assert scheduler.next_delay(True, set()) == FAST_INTERVAL
+
+
+def test_poll_is_rebooked_when_it_raises(run, monkeypatch):
+    booked = []
+    monkeypatch.setattr(
+        coordinator_module, "async_call_later",
+        lambda hass, delay, action: booked.append(delay) or (lambda: None))
+
+    async def scenario():
+        simulator, coordinator = await start()
+        coordinator._hass = object()
+
+        async def broken_fetch():
+            raise KeyError("ZONE_NAME")
+
+        coordinator._async_fetch = broken_fetch
+        try:
+            with pytest.raises(KeyError):
+                await coordinator.async_update()
+        finally:
+            await stop(simulator, coordinator)
+        return coordinator
+
+    coordinator = run(scenario())
+    assert len(booked) == 1
+    assert coordinator._unsub_poll is not None
+    assert booked[0] > coordinator.scheduler._base
+
+
+def test_commands_of_one_iteration_are_merged(run):
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            responses = await asyncio.gather(
+                coordinator.async_batched_command("FROST_ON", None, "Zone 1"),
+                coordinator.async_batched_command("FROST_ON", None, "Zone 2"),
+                coordinator.async_batched_command("SET_FROST", 9, "Zone 3"))
+        finally:
+            await stop(simulator, coordinator)
+        assert responses[0] == responses[1] == {"result": "frost on"}
+        assert simulator.stats.requests["FROST_ON"] == 1
+        assert simulator.stats.requests["SET_FROST"] == 1
+        assert simulator.devices["Zone 1"]["STANDBY"]
+        assert simulator.devices["Zone 2"]["STANDBY"]
+        assert not simulator.devices["Zone 3"]["STANDBY"]
+
+    run(scenario())
+
+
+def test_confirmed_optimistic_value_is_kept(run):
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            await coordinator.async_batched_command("FROST_ON", None, "Zone 1")
+            coordinator.apply_optimistic("Zone 1", standby=True)
+            assert coordinator.device("Zone 1").standby
+            await coordinator.async_request_refresh(["Zone 1"])
+        finally:
+            await stop(simulator, coordinator)
+        assert coordinator.device("Zone 1").standby
+        assert coordinator._expected == {}
+
+    run(scenario())
+
+
+def test_unconfirmed_optimistic_value_is_rolled_back(run):
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            # The command never reaches the hub.
+            coordinator.apply_optimistic("Zone 1", standby=True)
+            assert coordinator.device("Zone 1").standby
+            await coordinator.async_request_refresh(["Zone 1"])
+        finally:
+            await stop(simulator, coordinator)
+        assert not coordinator.device("Zone 1").standby
+        assert coordinator._expected == {}
+
+    run(scenario())
+
+
+def test_optimistic_value_survives_a_poll_before_the_command(run):
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            coordinator.apply_optimistic("Zone 1", standby=True)
+            # A background poll while the command is still on its way.
+            await coordinator.async_update(force=True)
+            shown = coordinator.device("Zone 1").standby
+        finally:
+            await stop(simulator, coordinator)
+        assert shown
+        assert coordinator._expected == {"Zone 1": {"standby": True}}
+
+    run(scenario())
+
+
+def test_breaker_opened_by_commands_is_published_by_the_next_poll(run):
+    async def scenario():
+        simulator, coordinator = await start()
+        updates = []
+        coordinator.add_listener(lambda: updates.append(True), "Zone 1")
+        await simulator.stop()
+        # Drop the kept-alive socket, the hub is now unreachable.
+        coordinator.client.close()
+        for _ in range(3):
+            assert not await coordinator.async_batched_command(
+                "FROST_ON", None, "Zone 1")
+        assert not coordinator.available
+        await coordinator.async_update()
+        published = len(updates)
+        await coordinator.async_update()
+        coordinator.client.close()
+        return published, len(updates)
+
+    published, later = run(scenario())
+    assert published == 1
+    assert later == 1
+
+
+def test_older_hubs_are_polled_through_info(run):
+    async def scenario():
+        simulator, coordinator = await start(live_data=False)
+        await stop(simulator, coordinator)
+        return simulator, coordinator
+
+    simulator, coordinator = run(scenario())
+    assert coordinator.live_data_supported is False
+    assert set(coordinator.devices) == {"Zone 1", "Zone 2", "Zone 3"}
+    assert simulator.stats.requests["INFO"] == 1
+
+
+def answer_error_once(simulator, failing):
+    """ Make the simulator answer command with an error, once. """
+    handle = simulator.handle
+
+    def patched(request):
+        if failing and failing[0] in request:
+            return {"error": "Invalid argument to %s" % failing.pop()}
+        return handle(request)
+
+    simulator.handle = patched
+
+
+def test_section_error_is_asked_for_again(run):
+    async def scenario():
+        simulator = NeoHubSimulator(zones=1, plugs=1, seed=1)
+        answer_error_once(simulator, ["GET_ENGINEERS"])
+        await simulator.start()
+        coordinator = NeoHubCoordinator(
+            NeoHubClient("127.0.0.1", simulator.port))
+        try:
+            await coordinator.async_update()
+            first = coordinator.device("Plug 1").device_type
+            await coordinator.async_update()
+        finally:
+            await stop(simulator, coordinator)
+        return simulator, coordinator, first
+
+    simulator, coordinator, first = run(scenario())
+    assert first is None
+    assert simulator.stats.requests["GET_ENGINEERS"] == 2
+    assert coordinator.device("Plug 1").neoplug
+    assert coordinator.device("Zone 1").frost_temperature == 12
+
+
+def test_missing_section_keeps_the_last_values(run):
+    async def scenario():
+        failing = []
+        simulator = NeoHubSimulator(zones=1, plugs=1, seed=1)
+        answer_error_once(simulator, failing)
+        await simulator.start()
+        coordinator = NeoHubCoordinator(
+            NeoHubClient("127.0.0.1", simulator.port))
+        try:
+            await coordinator.async_update()
+            # The engineers settings change, but the hub fails to send them.
+            simulator.timestamps["TIMESTAMP_ENGINEERS"] += 1
+            failing.append("GET_ENGINEERS")
+            coordinator.client.cache.invalidate()
+            await coordinator.async_update()
+        finally:
+            await stop(simulator, coordinator)
+        return coordinator
+
+    coordinator = run(scenario())
+    assert coordinator.device("Plug 1").neoplug
+    assert coordinator.device("Zone 1").frost_temperature == 12
+
+
+def test_unchanged_profile_is_not_written_again(run):
+    profile = {"Mon-Fri": {"wake": ["7:00", 21], "sleep": ["22:30", 16]}}
+
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            first = await coordinator.async_write_profiles(
+                {"Zone 1": profile, "Zone 2": profile})
+            second = await coordinator.async_write_profiles(
+                {"Zone 1": profile, "Zone 2": profile})
+        finally:
+            await stop(simulator, coordinator)
+        return simulator, first, second
+
+    simulator, first, second = run(scenario())
+    assert sorted(first) == ["Zone 1", "Zone 2"]
+    assert second == []
+    assert simulator.stats.requests["SET_COMFORT_LEVELS"] == 1
+    # The hub reads it back in its own spelling.
+    assert simulator.profiles["Zone 1"]["mon-fri"]["wake"] == ["07:00", 21.0]
+
+
+def test_own_profile_write_keeps_the_other_zones_cached(run):
+    profile = {"mon-fri": {"wake": ["06:30", 20.0]}}
+
+    async def scenario():
+        simulator, coordinator = await start()
+        try:
+            await coordinator.async_read_profiles(["Zone 1", "Zone 2", "Zone 3"])
+            await coordinator.async_write_profiles({"Zone 1": profile})
+            coordinator.client.cache.invalidate()
+            await coordinator.async_update()
+            reads = simulator.stats.requests["READ_COMFORT_LEVELS"]
+            profiles = await coordinator.async_read_profiles(["Zone 2", "Zone 3"])
+            unchanged = simulator.stats.requests["READ_COMFORT_LEVELS"] == reads
+            # A change made elsewhere still empties the cache.
+            simulator.timestamps["TIMESTAMP_PROFILE_COMFORT_LEVELS"] += 1
+            coordinator.client.cache.invalidate()
+            await coordinator.async_update()
+            emptied = coordinator.profiles == {}
+        finally:
+            await stop(simulator, coordinator)
+        return profiles, unchanged, emptied
+
+    profiles, unchanged, emptied = run(scenario())
+    assert all(profiles.values())
+    assert unchanged
+    assert emptied
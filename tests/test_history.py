@@ -0,0 +1,62 @@
+"""
+Tests of the per thermostat reading history.
+"""
+
+from heatmiserneo.history import DUTY_WINDOW, ZoneHistory
+
+
+def test_duty_cycle_over_windows():
+    history = ZoneHistory()
+    history.append(0, 18, 21, False)
+    history.append(3600, 18, 21, True)
+    assert history.duty_cycle(3600, 7200) == 100.0
+    assert history.duty_cycle(7200, 7200) == 50.0
+
+
+def test_duty_cycle_needs_the_whole_window():
+    history = ZoneHistory()
+    history.append(0, 18, 21, True)
+    assert history.duty_cycle(86400, 300) is None
+    assert history.duty_cycle(300, 300) == 100.0
+
+
+def test_duty_cycle_outlives_the_readings():
+    # A zone whose temperature moves on every poll fills the readings
+    # long before a day has passed.
+    history = ZoneHistory(size=100)
+    for index in range(DUTY_WINDOW // 10 + 1):
+        history.append(index * 10, 18 + index % 50 / 10, 21, index % 360 < 120)
+    assert len(history) == 100
+    assert history.duty_cycle(DUTY_WINDOW, DUTY_WINDOW) == 33.3
+    assert history.duty_cycle(3600, DUTY_WINDOW) == 33.3
+
+
+def test_duty_cycle_when_switching_on_every_poll():
+    history = ZoneHistory(size=10, min_interval=10)
+    for index in range(2 * DUTY_WINDOW // 10):
+        history.append(index * 10, 20, 21, index % 2 == 0)
+    now = 2 * DUTY_WINDOW
+    assert history.duty_cycle(DUTY_WINDOW, now) == 50.0
+    assert history.duty_cycle(DUTY_WINDOW + 20, now) is None
+
+
+def test_repeated_readings_are_stored_once():
+    history = ZoneHistory()
+    history.append(0, 20, 21, True)
+    history.append(60, 20, 21, True)
+    assert len(history) == 1
+
+
+def test_heat_rate_and_time_to_target():
+    history = ZoneHistory()
+    history.append(0, 18, 21, True)
+    history.append(300, 18.2, 21, True)
+    # Not trusted before MIN_RATE_SPAN of heating.
+    assert history.heat_rate is None
+    history.append(1800, 19, 21, True)
+    assert history.heat_rate == 2.0
+    assert history.time_to_target() == 60
+    # The rate of the finished run is kept.
+    history.append(3600, 21, 21, False)
+    assert history.heat_rate == 3.0
+    assert history.time_to_target() is None
@@ -0,0 +1,304 @@
+"""
+Tests of the Home Assistant free hub client: framing, the priority gate,
+the circuit breaker and requests against the simulator.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+import pytest
+
+from heatmiserneo.neohub import (
+    PRIORITY_COMMAND, PRIORITY_READ, READ_CHUNK, CircuitBreaker,
+    NeoHubClient, NeoHubFrameParser, PriorityGate)
+from neohub_simulator import NeoHubSimulator
+
+SILENT = object()
+
+
+async def start_hub(answer):
+    """ Start a hub answering each request with answer(socket, command).
+
+    answer returns the response frame, None to close the socket or SILENT
+    to never answer. Returns the server and the commands received.
+    """
+    received = []
+    sockets = []
+
+    async def handle(reader, writer):
+        sockets.append(writer)
+        while True:
+            try:
+                frame = await reader.readuntil(b"\0")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            if not frame.strip(b"\0\r\n"):
+                continue
+            command = next(iter(json.loads(frame[:-1])))
+            received.append(command)
+            response = answer(len(sockets), command)
+            if response is None:
+                break
+            if response is not SILENT:
+                writer.write(response)
+                await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, received
+
+
+async def stop_hub(server, client):
+    client.close()
+    server.close()
+    await server.wait_closed()
+
+
+def feed(parser, data, sizes):
+    """ Write data into the parser in reads of the given sizes. """
+    frames = []
+    position = 0
+    for size in sizes:
+        chunk = data[position:position + size]
+        position += size
+        buffer = parser.get_buffer()
+        buffer[:len(chunk)] = chunk
+        frames.extend(parser.buffer_updated(len(chunk)))
+    return frames
+
+
+def test_frames_split_across_reads():
+    frames = [json.dumps({"n": index, "pad": "x" * index * 97}).encode()
+              for index in range(50)]
+    data = b"".join(frame + b"\0" for frame in frames)
+    generator = random.Random(1)
+    sizes = []
+    while sum(sizes) < len(data):
+        sizes.append(generator.randint(1, READ_CHUNK))
+    assert feed(NeoHubFrameParser(), data, sizes) == frames
+
+
+def test_terminator_in_its_own_read():
+    parser = NeoHubFrameParser()
+    assert feed(parser, b'{"a": 1}', [8]) == []
+    assert feed(parser, b"\0", [1]) == [b'{"a": 1}']
+
+
+def test_frame_over_the_limit_is_refused():
+    parser = NeoHubFrameParser(limit=100)
+    with pytest.raises(ValueError):
+        feed(parser, b"x" * 200, [200])
+
+
+def test_large_response_from_simulator(run):
+    async def scenario():
+        simulator = NeoHubSimulator(zones=40, padding=2000, seed=1)
+        await simulator.start()
+        client = NeoHubClient("127.0.0.1", simulator.port)
+        try:
+            info = await client.async_json_request({"INFO": 0})
+            again = await client.async_json_request({"INFO": 0})
+        finally:
+            client.close()
+            await simulator.stop()
+        assert len(info["devices"]) == 40
+        assert again is info
+        assert simulator.stats.requests == {"INFO": 1}
+        assert client.stats.connections_opened == 1
+
+    run(scenario())
+
+
+def test_dead_kept_alive_socket_is_retried_once(run):
+    async def scenario():
+        def answer(socket, command):
+            if socket == 1 and command == "SET_TEMP":
+                # The hub dropped the first socket meanwhile.
+                return None
+            return b'{"result": "ok"}\0'
+
+        server, received = await start_hub(answer)
+        client = NeoHubClient("127.0.0.1", server.sockets[0].getsockname()[1])
+        try:
+            await client.async_json_request({"INFO": 0})
+            response = await client.async_json_request({"SET_TEMP": [20, "Zone 1"]})
+        finally:
+            await stop_hub(server, client)
+        assert response == {"result": "ok"}
+        assert received == ["INFO", "SET_TEMP", "SET_TEMP"]
+        assert client.health.failures == 0
+
+    run(scenario())
+
+
+def test_timeout_is_never_retried(run):
+    async def scenario():
+        def answer(socket, command):
+            if command == "SET_TEMP":
+                return SILENT
+            return b'{"result": "ok"}\0'
+
+        server, received = await start_hub(answer)
+        client = NeoHubClient(
+            "127.0.0.1", server.sockets[0].getsockname()[1], timeout=0.2)
+        try:
+            await client.async_json_request({"INFO": 0})
+            started = time.monotonic()
+            response = await client.async_json_request({"SET_TEMP": [20, "Zone 1"]})
+            elapsed = time.monotonic() - started
+        finally:
+            await stop_hub(server, client)
+        assert response is False
+        assert received == ["INFO", "SET_TEMP"]
+        assert elapsed < 0.4
+        assert client.stats.timeouts == 1
+
+    run(scenario())
+
+
+def test_garbled_response_is_a_failure(run):
+    async def scenario():
+        def answer(socket, command):
+            return b'{"devi\0' if socket == 1 else b'{"devices": []}\0'
+
+        server, received = await start_hub(answer)
+        client = NeoHubClient("127.0.0.1", server.sockets[0].getsockname()[1])
+        try:
+            first = await client.async_json_request({"INFO": 0})
+            failures = client.health.failures
+            idle = len(client._idle)
+            second = await client.async_json_request({"INFO": 0})
+        finally:
+            await stop_hub(server, client)
+        assert first is False
+        assert failures == 1
+        assert idle == 0
+        assert client.stats.errors == 1
+        assert second == {"devices": []}
+        assert client.health.failures == 0
+
+    run(scenario())
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker("hub", threshold=2, reset_timeout=30)
+    assert breaker.allow(0)
+    breaker.record_failure(0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available
+    assert not breaker.allow(10)
+
+    # Half open: a single probe goes through, and its failure reopens.
+    assert breaker.allow(31)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow(31)
+    breaker.record_failure(32)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow(40)
+
+    assert breaker.allow(62)
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.available
+    assert breaker.allow(62)
+
+
+def test_open_breaker_fails_fast(run):
+    async def scenario():
+        simulator = NeoHubSimulator(zones=1, seed=1)
+        await simulator.start()
+        port = simulator.port
+        await simulator.stop()
+        client = NeoHubClient("127.0.0.1", port)
+        try:
+            for _ in range(3):
+                assert not await client.async_json_request({"FROST_ON": "Zone 1"})
+            opened = client.stats.connections_opened
+            assert not await client.async_json_request({"FROST_ON": "Zone 1"})
+        finally:
+            client.close()
+        assert client.health.state == CircuitBreaker.OPEN
+        assert opened == client.stats.connections_opened == 0
+        assert client.stats.errors == 3
+
+    run(scenario())
+
+
+def test_command_overtakes_queued_reads(run):
+    async def scenario():
+        gate = PriorityGate(1)
+        order = []
+
+        async def request(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        assert await gate.acquire(PRIORITY_READ)
+        tasks = [asyncio.ensure_future(request("read 1", PRIORITY_READ)),
+                 asyncio.ensure_future(request("read 2", PRIORITY_READ))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request("command", PRIORITY_COMMAND)))
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == ["command", "read 1", "read 2"]
+
+
+def test_cancelled_waiter_passes_its_turn_on(run):
+    async def scenario():
+        gate = PriorityGate(1)
+        assert await gate.acquire(PRIORITY_READ)
+        cancelled = asyncio.ensure_future(gate.acquire(PRIORITY_READ))
+        waiting = asyncio.ensure_future(gate.acquire(PRIORITY_READ))
+        await asyncio.sleep(0)
+        # The socket is handed to the first waiter, which is cancelled
+        # before it gets to run.
+        gate.release()
+        cancelled.cancel()
+        assert await waiting
+        assert cancelled.cancelled()
+        gate.release()
+        # Nothing holds the socket any more, so it is free again.
+        assert await asyncio.wait_for(gate.acquire(PRIORITY_READ), 1)
+
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue(run):
+    async def scenario():
+        gate = PriorityGate(1)
+        assert await gate.acquire(PRIORITY_READ)
+        cancelled = asyncio.ensure_future(gate.acquire(PRIORITY_READ))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert gate.queued[PRIORITY_READ] == 0
+        gate.release()
+        assert await asyncio.wait_for(gate.acquire(PRIORITY_READ), 1)
+
+    run(scenario())
+
+
+def test_full_queue_rejects_requests(run):
+    async def scenario():
+        gate = PriorityGate(1, max_queue=1)
+        assert await gate.acquire(PRIORITY_READ)
+        queued = asyncio.ensure_future(gate.acquire(PRIORITY_READ))
+        await asyncio.sleep(0)
+        assert not await gate.acquire(PRIORITY_READ)
+        # Commands have their own queue.
+        command = asyncio.ensure_future(gate.acquire(PRIORITY_COMMAND))
+        await asyncio.sleep(0)
+        gate.release()
+        assert await command
+        gate.release()
+        assert await queued
+
+    run(scenario())
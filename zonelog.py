@@ -0,0 +1,111 @@
+"""
+homeassistant.components.climate.heatmiserneo.zonelog
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Temperature logs and hours run counters of the zones of a Neo-hub, kept
+locally so finished days outlive the hub's own window.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+TEMPERATURE_LOG = "GET_TEMPLOG"
+HOURS_RUN = "GET_HOURSRUN"
+LOG_COMMANDS = (TEMPERATURE_LOG, HOURS_RUN)
+
+# Days of history kept per zone, and seconds before a new period is saved.
+MAX_PERIODS = 90
+SAVE_DELAY = 30
+
+# Seconds a zone's log is reused before it is read again, today's period
+# keeps growing until midnight.
+LOG_TTL = 1800
+
+
+class ZoneLogs:
+    """ Zone logs of one hub, read in bulk and cached per period.
+
+    The hub answers a log command for many zones at once with the recent
+    periods of each zone. Periods already cached are kept, so history
+    outlives the hub's own window. Finished days never change, a zone is
+    only asked for again once its read is LOG_TTL old, to bring today's
+    period up to date.
+    """
+
+    def __init__(self, client, store=None):
+        self.client = client
+        self._store = store
+        self.periods = {command: {} for command in LOG_COMMANDS}
+        # Time of the last read of each zone.
+        self._fetched = {command: {} for command in LOG_COMMANDS}
+        self._pending = {}
+
+    async def async_load(self):
+        """ Load the logs saved by a previous run. """
+        if self._store is None:
+            return
+        data = await self._store.async_load()
+        if not data:
+            return
+        for command in LOG_COMMANDS:
+            self.periods[command] = data.get("periods", {}).get(command, {})
+            self._fetched[command] = data.get("fetched", {}).get(command, {})
+
+    def _save_data(self):
+        """ Return the logs in the form they are saved in. """
+        return {"periods": self.periods, "fetched": self._fetched}
+
+    async def async_get(self, command, names, today=None, now=None):
+        """ Return the cached periods of each zone, reading new ones first.
+
+        Zones not read within LOG_TTL are requested, together with those
+        asked for by other callers in the same loop iteration.
+        """
+        today = today or datetime.date.today().isoformat()
+        now = time.time() if now is None else now
+        fetched = self._fetched[command]
+        missing = [
+            name for name in names
+            if not isinstance(fetched.get(name), (int, float))
+            or now - fetched[name] >= LOG_TTL
+        ]
+        if missing:
+            pending = self._pending.get(command)
+            if pending is None:
+                pending = self._pending[command] = (
+                    set(), asyncio.ensure_future(
+                        self._async_read(command, today, now)))
+            pending[0].update(missing)
+            await asyncio.shield(pending[1])
+        periods = self.periods[command]
+        return {name: periods.get(name, {}) for name in names}
+
+    async def _async_read(self, command, today, now):
+        """ Read the queued zones in one request once every caller joined. """
+        await asyncio.sleep(0)
+        names, _ = self._pending.pop(command)
+        response = await self.client.async_json_request({command: sorted(names)})
+        if not response:
+            return
+        for name in names:
+            if name not in response:
+                continue
+            self._merge(command, name, response[name], today)
+            self._fetched[command][name] = now
+        if self._store is not None:
+            self._store.async_delay_save(self._save_data, SAVE_DELAY)
+
+    def _merge(self, command, name, log, today):
+        """ Add the periods of a zone's log to its cached ones. """
+        periods = self.periods[command].setdefault(name, {})
+        if isinstance(log, dict):
+            periods.update(log)
+        else:
+            # A log without period labels is the one read today.
+            periods[today] = log
+        for period in sorted(periods)[:-MAX_PERIODS]:
+            del periods[period]